@@ -1,29 +1,460 @@
+import copy
+import hashlib
+import heapq
+import itertools
+import math
+import os
+import sys
+import time
+import unittest
+from collections import Counter
+
+import numpy as np
+
+# O dicionário de itens e o agregador vetorizado são os mesmos do pipeline de
+# músicas: os clientes e o servidor compartilham um ItemDictionary, que codifica
+# cada item em um ID inteiro denso na ordem da primeira aparição, e as respostas
+# (ids, valores) são somadas com NumPy só quando um resultado é pedido
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Final Code', 'heavy_hitters'))
+from item_aggregation import ItemAggregator, ItemDictionary  # noqa: E402
+
+
+# Backends de contagem para os heavy hitters.
+#
+# Todos seguem a mesma interface: update(items) resume os dados do cliente,
+# merge(other) combina dois resumos do mesmo tipo e configuração,
+# estimate(item) devolve a contagem estimada, heavy_hitters(threshold) devolve
+# {item: contagem estimada} e error_bound() devolve o erro máximo por item.
+# ExactCounter é o modo de referência (dicionário exato, erro 0); os demais
+# usam memória fixa, independente do vocabulário.
+
+# Os dados são resumidos em lotes de no máximo BATCH_SIZE itens, o que limita
+# a memória do Counter temporário.
+BATCH_SIZE = 65536
+
+
+def _batches(items, batch_size=BATCH_SIZE):
+    iterator = iter(items)
+    while True:
+        batch = Counter(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+class ExactCounter:
+    # Contagem exata: memória proporcional ao número de itens distintos
+    def __init__(self):
+        self.counts = {}
+        self.total = 0
+
+    def update(self, items):
+        for batch in _batches(items):
+            self.total += sum(batch.values())
+            self._merge_counts(batch)
+
+    def _merge_counts(self, counts):
+        for item, count in counts.items():
+            self.counts[item] = self.counts.get(item, 0) + count
+
+    def merge(self, other):
+        self.total += other.total
+        self._merge_counts(other.counts)
+
+    def estimate(self, item):
+        return self.counts.get(item, 0)
+
+    def heavy_hitters(self, threshold):
+        return {item: count for item, count in self.counts.items() if count >= threshold}
+
+    def error_bound(self):
+        return 0
+
+    def __len__(self):
+        return len(self.counts)
+
+
+class MisraGries:
+    # Resumo de Misra-Gries com no máximo `capacity` contadores. As estimativas
+    # subestimam: estimate(x) <= f(x) <= estimate(x) + error_bound(), com
+    # error_bound() <= total / (capacity + 1), inclusive depois de merges.
+    # heavy_hitters devolve todo item do resumo que pode atingir o threshold;
+    # para threshold > error_bound() não há falsos negativos.
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self.counts = {}
+        self.total = 0
+        self.error = 0
+
+    def update(self, items):
+        for batch in _batches(items):
+            self.total += sum(batch.values())
+            self._merge_counts(batch, 0)
+
+    def _merge_counts(self, counts, error):
+        for item, count in counts.items():
+            self.counts[item] = self.counts.get(item, 0) + count
+        self.error += error
+        self._reduce()
+
+    def _reduce(self):
+        # Subtrai o (capacity + 1)-ésimo maior contador de todos e descarta os que zeram
+        if len(self.counts) <= self.capacity:
+            return
+        decrement = heapq.nlargest(self.capacity + 1, self.counts.values())[-1]
+        self.counts = {item: count - decrement for item, count in self.counts.items() if count > decrement}
+        self.error += decrement
+
+    def merge(self, other):
+        self.total += other.total
+        self._merge_counts(other.counts, other.error)
+
+    def estimate(self, item):
+        return self.counts.get(item, 0)
+
+    def heavy_hitters(self, threshold):
+        return {item: count for item, count in self.counts.items() if count + self.error >= threshold}
+
+    def error_bound(self):
+        return self.error
+
+    def __len__(self):
+        return len(self.counts)
+
+
+class SpaceSaving:
+    # Resumo SpaceSaving com no máximo `capacity` contadores. As estimativas
+    # superestimam: estimate(x) - error_bound() <= f(x) <= estimate(x), e todo
+    # item fora do resumo tem f(x) <= error_bound(), que fica em torno de
+    # total / capacity. Para threshold > error_bound(), heavy_hitters não tem
+    # falsos negativos.
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self.counts = {}
+        self.total = 0
+        self.error = 0
+
+    def update(self, items):
+        for batch in _batches(items):
+            self.total += sum(batch.values())
+            self._merge_counts(batch, 0)
+
+    def _merge_counts(self, counts, error):
+        # Item ausente de um lado pode ter até o erro daquele lado
+        merged = {}
+        for item in self.counts.keys() | counts.keys():
+            merged[item] = self.counts.get(item, self.error) + counts.get(item, error)
+        self.error += error
+        if len(merged) > self.capacity:
+            kept = heapq.nlargest(self.capacity + 1, merged.items(), key=lambda entry: entry[1])
+            self.error = max(self.error, kept[-1][1])
+            merged = dict(kept[:-1])
+        self.counts = merged
+
+    def merge(self, other):
+        self.total += other.total
+        self._merge_counts(other.counts, other.error)
+
+    def estimate(self, item):
+        return self.counts.get(item, self.error)
+
+    def heavy_hitters(self, threshold):
+        return {item: count for item, count in self.counts.items() if count >= threshold}
+
+    def error_bound(self):
+        return self.error
+
+    def __len__(self):
+        return len(self.counts)
+
+
+class CountMin:
+    # Count-Min com `depth` linhas de `width` contadores, mais um conjunto de
+    # até `capacity` candidatos com as maiores estimativas (o sketch sozinho não
+    # enumera itens). As estimativas superestimam: com probabilidade de pelo
+    # menos 1 - exp(-depth), estimate(x) - f(x) <= error_bound() = e * total / width.
+    # O limite exige hashes independentes por linha: cada linha usa blake2b com
+    # um salt derivado de (seed, linha).
+    # Os resumos só podem ser combinados se tiverem mesmos width, depth e seed.
+    def __init__(self, width=2048, depth=4, capacity=100, seed=0):
+        self.width = width
+        self.depth = depth
+        self.capacity = capacity
+        self.seed = seed
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.candidates = set()
+        self.total = 0
+        self._salts = [hashlib.blake2b(f'{seed}:{row}'.encode(), digest_size=16).digest() for row in range(depth)]
+
+    def _columns(self, item):
+        key = str(item).encode('utf-8')
+        return [int.from_bytes(hashlib.blake2b(key, digest_size=8, salt=salt).digest(), 'little') % self.width
+                for salt in self._salts]
+
+    def update(self, items):
+        for batch in _batches(items):
+            self._merge_counts(batch)
+
+    def _merge_counts(self, counts):
+        items = list(counts)
+        if not items:
+            return
+        columns = np.array([self._columns(item) for item in items], dtype=np.int64)
+        values = np.fromiter(counts.values(), dtype=np.int64, count=len(items))
+        for row in range(self.depth):
+            np.add.at(self.table[row], columns[:, row], values)
+        self.total += int(values.sum())
+        self._keep_candidates(items)
+
+    def _keep_candidates(self, items):
+        self.candidates.update(items)
+        if len(self.candidates) > self.capacity:
+            self.candidates = set(heapq.nlargest(self.capacity, self.candidates, key=self.estimate))
+
+    def merge(self, other):
+        if (self.width, self.depth, self.seed) != (other.width, other.depth, other.seed):
+            raise ValueError("Count-Min sketches with different width, depth or seed cannot be merged")
+        self.table += other.table
+        self.total += other.total
+        self._keep_candidates(other.candidates)
+
+    def estimate(self, item):
+        return int(self.table[np.arange(self.depth), self._columns(item)].min())
+
+    def heavy_hitters(self, threshold):
+        estimates = {item: self.estimate(item) for item in self.candidates}
+        return {item: count for item, count in estimates.items() if count >= threshold}
+
+    def error_bound(self):
+        return math.e * self.total / self.width
+
+    def __len__(self):
+        return len(self.candidates)
+
+
+# Contagens em janela de tempo para o modo contínuo: os clientes enviam só os
+# eventos novos (deltas) e cada delta entra no bucket de bucket_size segundos
+# do seu timestamp. A janela cobre os últimos window_buckets buckets
+# ('sliding') ou blocos fixos de window_buckets buckets ('tumbling'). Os
+# totais da janela e os heavy hitters do último threshold pedido são
+# atualizados a cada mudança, então um delta ou um bucket expirado custa
+# O(itens alterados), não O(todos os dados).
+class WindowedCounter:
+    def __init__(self, window_buckets, bucket_size=60.0, mode='sliding'):
+        if mode not in ('sliding', 'tumbling'):
+            raise ValueError(f"Modo de janela desconhecido: {mode}")
+        self.window_buckets = window_buckets
+        self.bucket_size = bucket_size
+        self.mode = mode
+        self.buckets = {}  # bucket -> {item: contagem}
+        self.counts = {}   # totais da janela
+        self.total = 0
+        self.latest_bucket = None
+        self.threshold = None
+        self.heavy = {}
+
+    def _bucket(self, timestamp):
+        return int(timestamp // self.bucket_size)
+
+    def _first_live_bucket(self, bucket):
+        if self.mode == 'sliding':
+            return bucket - self.window_buckets + 1
+        return bucket - bucket % self.window_buckets
+
+    def _change(self, item, delta):
+        count = self.counts.get(item, 0) + delta
+        if count:
+            self.counts[item] = count
+        else:
+            self.counts.pop(item, None)
+        if self.threshold is not None:
+            if count >= self.threshold:
+                self.heavy[item] = count
+            else:
+                self.heavy.pop(item, None)
+
+    def advance(self, timestamp):
+        # Expira os buckets que saíram da janela; o tempo nunca volta
+        bucket = self._bucket(timestamp)
+        if self.latest_bucket is not None and bucket <= self.latest_bucket:
+            return
+        self.latest_bucket = bucket
+        first_live = self._first_live_bucket(bucket)
+        for expired in [old for old in self.buckets if old < first_live]:
+            for item, count in self.buckets.pop(expired).items():
+                self.total -= count
+                self._change(item, -count)
+
+    def add(self, counts, timestamp):
+        # Eventos atrasados entram no seu bucket se ele ainda estiver na janela
+        self.advance(timestamp)
+        bucket = self._bucket(timestamp)
+        if bucket < self._first_live_bucket(self.latest_bucket):
+            return
+        bucket_counts = self.buckets.setdefault(bucket, {})
+        for item, count in counts.items():
+            bucket_counts[item] = bucket_counts.get(item, 0) + count
+            self.total += count
+            self._change(item, count)
+
+    def heavy_hitters(self, threshold):
+        # Um threshold novo percorre a janela uma vez; depois o resultado é mantido incrementalmente
+        if threshold != self.threshold:
+            self.threshold = threshold
+            self.heavy = {item: count for item, count in self.counts.items() if count >= threshold}
+        return dict(self.heavy)
+
+    def __len__(self):
+        return len(self.counts)
+
+
+# Agregação em árvore do FederatedServer (fan_out): cada merge_group combina
+# até fan_out respostas do nível anterior num único resumo do mesmo formato
+def tree_reduce(partials, merge_group, fan_out, executor=None):
+    # Devolve o resumo combinado de todos os partials, ou None se não houver nenhum
+    if fan_out < 2:
+        raise ValueError("fan_out deve ser pelo menos 2")
+    level = partials
+    while True:
+        iterator = iter(level)
+        groups = iter(lambda: list(itertools.islice(iterator, fan_out)), [])
+        merged = list(executor.map(merge_group, groups) if executor is not None else map(merge_group, groups))
+        if len(merged) <= 1:
+            return merged[0] if merged else None
+        level = merged
+
+
+def merge_count_dicts(responses):
+    merged = {}
+    for response in responses:
+        for item, count in response.items():
+            merged[item] = merged.get(item, 0) + count
+    return merged
+
+
+def merge_encoded_counts(responses):
+    # Respostas (ids, contagens) de clientes ou (ids, somas, respostas) de agregadores viram um
+    # único trio com ids distintos; o número de respostas mantém corretas as estatísticas count e mean
+    responses = [response if len(response) == 3 else (*response, np.ones(len(response[0]), dtype=np.int64))
+                 for response in responses]
+    ids = np.concatenate([ids for ids, _, _ in responses])
+    unique_ids, inverse = np.unique(ids, return_inverse=True)
+    sums = np.zeros(len(unique_ids), dtype=np.int64)
+    counts = np.zeros(len(unique_ids), dtype=np.int64)
+    np.add.at(sums, inverse, np.concatenate([sums for _, sums, _ in responses]))
+    np.add.at(counts, inverse, np.concatenate([counts for _, _, counts in responses]))
+    return unique_ids, sums, counts
+
+
+def merge_sketches(responses):
+    # A cópia deixa os resumos recebidos intactos
+    merged = copy.deepcopy(responses[0])
+    for response in responses[1:]:
+        merged.merge(response)
+    return merged
+
+
 # Simulação de um ambiente federado
 class FederatedServer:
-    def __init__(self):
-        self.global_counts = {}
+    # sketch_factory=None mantém o modo de referência com dicionários exatos.
+    # Com um backend (ex.: lambda: SpaceSaving(100)), cada cliente envia o seu
+    # resumo de tamanho fixo, o servidor faz o merge e o threshold é aplicado
+    # apenas no resultado final. Com um ItemDictionary, o resultado é o mesmo
+    # do modo de referência, mas os clientes enviam (ids, contagens) e a soma
+    # é vetorizada. Com fan_out, qualquer um dos modos agrega em árvore
+    # (tree_reduce), usando o executor para os agregadores intermediários.
+    # Com um WindowedCounter (window), o servidor fica no modo contínuo: cada
+    # rodada aplica os deltas dos clientes e os heavy hitters cobrem só a janela.
+    def __init__(self, sketch_factory=None, dictionary=None, fan_out=None, executor=None, window=None):
+        self.sketch_factory = sketch_factory
+        self.dictionary = dictionary
+        self.fan_out = fan_out
+        self.executor = executor
+        self.window = window
+        if window is not None:
+            self.global_counts = window
+        elif sketch_factory is not None:
+            self.global_counts = sketch_factory()
+        elif dictionary is not None:
+            self.global_counts = ItemAggregator(dictionary, dtype=np.int64)
+        else:
+            self.global_counts = {}
 
     def send_task(self, clients, threshold):
-        client_responses = []
+        if self.window is not None:
+            self.send_delta(clients, time.time())
+            return
+        # As respostas são geradas sob demanda, sem montar a lista de todos os clientes
+        self.aggregate(self._client_response(client, threshold) for client in clients)
+
+    def send_delta(self, clients, timestamp):
+        # Modo contínuo: cada cliente envia só os eventos novos desde a última rodada
         for client in clients:
-            client_responses.append(client.find_heavy_hitters(threshold))
-        self.aggregate(client_responses)
+            self.window.add(client.report_delta(), timestamp)
+
+    def _client_response(self, client, threshold):
+        if self.sketch_factory is not None:
+            return client.summarize(self.sketch_factory)
+        if self.dictionary is not None:
+            return client.find_heavy_hitters_encoded(self.dictionary, threshold)
+        return client.find_heavy_hitters(threshold)
+
+    def _merge_group(self):
+        if self.sketch_factory is not None:
+            return merge_sketches
+        if self.dictionary is not None:
+            return merge_encoded_counts
+        return merge_count_dicts
 
     def aggregate(self, client_responses):
+        if self.fan_out is not None:
+            merged = tree_reduce(client_responses, self._merge_group(), self.fan_out, self.executor)
+            client_responses = [] if merged is None else [merged]
         for response in client_responses:
+            if self.sketch_factory is not None:
+                self.global_counts.merge(response)
+                continue
+            if self.dictionary is not None:
+                self.global_counts.add(*response)
+                continue
             for item, count in response.items():
                 if item in self.global_counts:
                     self.global_counts[item] += count
                 else:
                     self.global_counts[item] = count
 
-    def get_final_heavy_hitters(self, threshold):
+    def get_final_heavy_hitters(self, threshold, now=None):
+        if self.window is not None:
+            if now is not None:
+                self.window.advance(now)
+            return self.window.heavy_hitters(threshold)
+        if self.sketch_factory is not None or self.dictionary is not None:
+            return self.global_counts.heavy_hitters(threshold)
         return {item: count for item, count in self.global_counts.items() if count >= threshold}
 
+    def error_bound(self):
+        return 0 if self.sketch_factory is None else self.global_counts.error_bound()
+
 
 class Client:
-    def __init__(self, data):
+    # Com keep_history=False (modo contínuo), o cliente guarda só os eventos
+    # ainda não enviados: report_delta esvazia data, e a memória não cresce
+    # com o total de eventos. As respostas de rodada única precisam do histórico.
+    def __init__(self, data, keep_history=True):
         self.data = data
+        self.keep_history = keep_history
+        self.reported = 0  # Eventos já enviados no modo contínuo
+
+    def add_events(self, items):
+        self.data.extend(items)
+
+    def report_delta(self):
+        delta = Counter(self.data[self.reported:])
+        if self.keep_history:
+            self.reported = len(self.data)
+        else:
+            self.data.clear()
+        return delta
 
     def report_counts(self):
         local_counts = {}
@@ -38,31 +469,125 @@ class Client:
         local_counts = self.report_counts()
         return {item: count for item, count in local_counts.items() if count >= threshold}
 
+    def find_heavy_hitters_encoded(self, dictionary, threshold):
+        # Mesma resposta de find_heavy_hitters, como arrays (ids, contagens)
+        local_counts = Counter(self.data)
+        heavy_hitters = [(item, count) for item, count in local_counts.items() if count >= threshold]
+        ids = dictionary.encode(item for item, _ in heavy_hitters)
+        counts = np.fromiter((count for _, count in heavy_hitters), dtype=np.int64, count=len(heavy_hitters))
+        return ids, counts
+
+    def summarize(self, sketch_factory):
+        sketch = sketch_factory()
+        sketch.update(self.data)
+        return sketch
+
+
+# Testes dos backends de contagem
+class CountMinTest(unittest.TestCase):
+
+    def test_rows_hash_independently(self):
+        # Itens do mesmo tamanho que colidem numa linha não devem colidir em todas
+        sketch = CountMin(2048, 4)
+        sketch.update(['item00800'] + ['item00786'] * 1000)
+        self.assertEqual(sketch.estimate('item00800'), 1)
+
+    def test_error_bound(self):
+        rng = np.random.default_rng(0)
+        counts = Counter(f'item{value:05d}' for value in rng.zipf(1.3, 50_000) % 20_000)
+        for depth in (1, 4):
+            sketch = CountMin(256, depth)
+            sketch.update(list(counts.elements()))
+            errors = np.array([sketch.estimate(item) - count for item, count in counts.items()])
+            self.assertTrue(np.all(errors >= 0))
+            self.assertLessEqual(np.mean(errors > sketch.error_bound()), math.exp(-depth))
+
+
+class FederatedServerTest(unittest.TestCase):
+
+    def test_tree_aggregation_keeps_statistics(self):
+        rng = np.random.default_rng(0)
+        clients = [Client([f'i{value}' for value in rng.integers(0, 40, 30)]) for _ in range(20)]
+        dictionary = ItemDictionary()
+        flat = FederatedServer(dictionary=dictionary)
+        tree = FederatedServer(dictionary=dictionary, fan_out=4)
+        flat.send_task(clients, 1)
+        tree.send_task(clients, 1)
+        for statistic in ('sum', 'count', 'mean'):
+            self.assertEqual(tree.global_counts.heavy_hitters(0, statistic),
+                             flat.global_counts.heavy_hitters(0, statistic))
+
+
+class ClientTest(unittest.TestCase):
+
+    def test_stream_client_buffers_only_unreported_events(self):
+        client = Client([], keep_history=False)
+        client.add_events(['a', 'b', 'a'])
+        self.assertEqual(client.report_delta(), Counter({'a': 2, 'b': 1}))
+        self.assertEqual(client.data, [])
+        client.add_events(['b'])
+        self.assertEqual(client.report_delta(), Counter({'b': 1}))
+        self.assertEqual(client.report_delta(), Counter())
+
+    def test_history_client_reports_each_event_once(self):
+        client = Client(['a'])
+        client.add_events(['b'])
+        self.assertEqual(client.report_delta(), Counter({'a': 1, 'b': 1}))
+        client.add_events(['a'])
+        self.assertEqual(client.report_delta(), Counter({'a': 1}))
+        self.assertEqual(client.report_counts(), {'a': 2, 'b': 1})
+
+
+if __name__ == "__main__":
+    # Dados de exemplo para cada cliente
+    clients_data = [
+        ['item2', 'item1', 'item3', 'item1', 'item2'],
+        ['item2', 'item2', 'item1', 'item2'],
+        ['item3', 'item3', 'item1', 'item2'],
+        ['item4', 'item1', 'item2'],
+        ['item1', 'item2', 'item3', 'item4'],
+        ['item5', 'item2', 'item3', 'item4'],
+        ['item5', 'item5', 'item3', 'item2', 'item1'],
+        ['item6', 'item1', 'item2', 'item3']
+    ]
+
+    # Criação de clientes
+    clients = [Client(data) for data in clients_data]
+
+    # Servidor federado
+    server = FederatedServer()
 
-# Dados de exemplo para cada cliente
-clients_data = [
-    ['item2', 'item1', 'item3', 'item1', 'item2'],
-    ['item2', 'item2', 'item1', 'item2'],
-    ['item3', 'item3', 'item1', 'item2'],
-    ['item4', 'item1', 'item2'],
-    ['item1', 'item2', 'item3', 'item4'],
-    ['item5', 'item2', 'item3', 'item4'],
-    ['item5', 'item5', 'item3', 'item2', 'item1'],
-    ['item6', 'item1', 'item2', 'item3']
-]
+    # Definindo o threshold
+    threshold = 2
 
-# Criação de clientes
-clients = [Client(data) for data in clients_data]
+    # Servidor envia tarefa para encontrar heavy hitters para todos os clientes
+    server.send_task(clients, threshold)
 
-# Servidor federado
-server = FederatedServer()
+    # Recuperar e imprimir heavy hitters finais
+    print(server.get_final_heavy_hitters(threshold))  # Threshold ajustável conforme a necessidade
 
-# Definindo o threshold
-threshold = 2
+    # Mesma tarefa com a agregação vetorizada sobre IDs inteiros
+    encoded_server = FederatedServer(dictionary=ItemDictionary())
+    encoded_server.send_task(clients, threshold)
+    print(encoded_server.get_final_heavy_hitters(threshold))
 
-# Servidor envia tarefa para encontrar heavy hitters para todos os clientes
-server.send_task(clients, threshold)
+    # Mesma tarefa com agregação em árvore (grupos de 3 respostas por agregador intermediário)
+    tree_server = FederatedServer(fan_out=3)
+    tree_server.send_task(clients, threshold)
+    print(tree_server.get_final_heavy_hitters(threshold))
 
-# Recuperar e imprimir heavy hitters finais
-print(server.get_final_heavy_hitters(threshold))  # Threshold ajustável conforme a necessidade
+    # Modo contínuo: janela deslizante de 2 buckets de 60 s, com os clientes enviando só os eventos novos
+    window_server = FederatedServer(window=WindowedCounter(2, 60.0))
+    stream_clients = [Client([], keep_history=False) for _ in clients_data]
+    for minute, events in enumerate([clients_data[:4], clients_data[4:], [['item6', 'item6']] * 4]):
+        for client, data in zip(stream_clients, events):
+            client.add_events(data)
+        window_server.send_delta(stream_clients, minute * 60.0)
+        print(f"minuto {minute}:", window_server.get_final_heavy_hitters(threshold))
 
+    # Mesma tarefa com os backends de tamanho fixo
+    for sketch_factory in (lambda: MisraGries(4), lambda: SpaceSaving(4), lambda: CountMin(64, 4, 4)):
+        sketch_server = FederatedServer(sketch_factory)
+        sketch_server.send_task(clients, threshold)
+        print(type(sketch_server.global_counts).__name__, sketch_server.get_final_heavy_hitters(threshold),
+              "erro <=", sketch_server.error_bound())
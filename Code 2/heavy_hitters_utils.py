@@ -0,0 +1,176 @@
+import sys
+from collections.abc import Iterator
+
+import numpy as np
+
+# Funções de heavy_hitters_utils com backend selecionável.
+#
+# O backend padrão é NumPy, então importar este módulo não carrega o
+# TensorFlow. O backend 'tensorflow' é usado automaticamente quando o sinal é
+# um tf.Tensor (nesse caso o TensorFlow já foi importado por quem chamou) ou
+# quando backend='tensorflow' é pedido explicitamente. Os dois backends dão os
+# mesmos resultados: o NumPy devolve np.ndarray e o TensorFlow devolve tf.Tensor.
+
+NUMPY_BACKEND = 'numpy'
+TENSORFLOW_BACKEND = 'tensorflow'
+
+
+def _is_tf_tensor(value):
+    tf = sys.modules.get('tensorflow')
+    return tf is not None and isinstance(value, (tf.Tensor, tf.Variable))
+
+
+def _select_backend(signal, backend):
+    if backend is None:
+        return TENSORFLOW_BACKEND if _is_tf_tensor(signal) else NUMPY_BACKEND
+    if backend not in (NUMPY_BACKEND, TENSORFLOW_BACKEND):
+        raise ValueError(f"Backend desconhecido: {backend}")
+    return backend
+
+
+def _tf():
+    import tensorflow as tf
+    return tf
+
+
+def _top_indices(counts, k):
+    # Índices das k maiores contagens por seleção parcial; empates ficam com o menor índice,
+    # como em tf.math.top_k
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    candidates = np.arange(len(counts))
+    if k < len(counts):
+        kth_count = np.partition(counts, len(counts) - k)[len(counts) - k]
+        candidates = np.flatnonzero(counts >= kth_count)
+    return candidates[np.argsort(-counts[candidates], kind='stable')[:k]]
+
+
+def top_k(signal, k, backend=None):
+    # Os k valores mais frequentes e suas contagens; empates mantêm a ordem da primeira aparição.
+    # Um iterador de lotes (ex.: um gerador) é processado por top_k_batches.
+    if isinstance(signal, Iterator):
+        return top_k_batches(signal, k)
+
+    if _select_backend(signal, backend) == TENSORFLOW_BACKEND:
+        tf = _tf()
+        unique, _, counts = tf.unique_with_counts(tf.reshape(signal, [-1]))
+        _, top_indices = tf.math.top_k(counts, k=tf.minimum(k, tf.size(counts)))
+        return tf.gather(unique, top_indices), tf.gather(counts, top_indices)
+
+    signal = np.asarray(signal).reshape(-1)
+    unique, first_index, counts = np.unique(signal, return_index=True, return_counts=True)
+    # Mesma ordem de tf.unique_with_counts (primeira aparição)
+    appearance = np.argsort(first_index, kind='stable')
+    unique, counts = unique[appearance], counts[appearance].astype(np.int32)
+    top_indices = _top_indices(counts, k)
+    return unique[top_indices], counts[top_indices]
+
+
+class StreamingTopK:
+    # Contagens acumuladas entre lotes do sinal, sem manter o sinal inteiro em
+    # memória. Com max_counters=None as contagens são exatas e o resultado é
+    # igual ao de top_k sobre o sinal concatenado (a memória cresce com o número
+    # de valores distintos). Com max_counters, no máximo esse número de
+    # contadores é mantido, no estilo SpaceSaving: cada contagem superestima a
+    # real em no máximo `error`.
+    def __init__(self, k, max_counters=None):
+        self.k = k
+        self.max_counters = max_counters
+        self.values = None
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.first_seen = np.zeros(0, dtype=np.int64)
+        self.error = 0
+        self.seen = 0
+        self._tensorflow = False
+
+    def update(self, batch):
+        if _is_tf_tensor(batch):
+            self._tensorflow = True
+            batch = batch.numpy()
+        batch = np.asarray(batch).reshape(-1)
+        unique, first_index, counts = np.unique(batch, return_index=True, return_counts=True)
+        first_index = first_index + self.seen
+        self.seen += batch.size
+        if self.values is None:
+            self.values, self.counts, self.first_seen = unique, counts.astype(np.int64), first_index
+        else:
+            # Um valor novo neste lote pode ter sido descartado antes com até `error` ocorrências
+            counts = counts + np.where(np.isin(unique, self.values), 0, self.error)
+            values, inverse = np.unique(np.concatenate([self.values, unique]), return_inverse=True)
+            merged_counts = np.zeros(len(values), dtype=np.int64)
+            np.add.at(merged_counts, inverse, np.concatenate([self.counts, counts]))
+            merged_first_seen = np.full(len(values), np.iinfo(np.int64).max)
+            np.minimum.at(merged_first_seen, inverse, np.concatenate([self.first_seen, first_index]))
+            self.values, self.counts, self.first_seen = values, merged_counts, merged_first_seen
+        if self.max_counters is not None and len(self.counts) > self.max_counters:
+            kept = np.argpartition(-self.counts, self.max_counters)
+            dropped, kept = kept[self.max_counters:], kept[:self.max_counters]
+            self.error = max(self.error, int(self.counts[dropped].max()))
+            self.values, self.counts, self.first_seen = self.values[kept], self.counts[kept], self.first_seen[kept]
+
+    def result(self):
+        if self.values is None:
+            return np.zeros(0), np.zeros(0, dtype=np.int64)
+        appearance = np.argsort(self.first_seen, kind='stable')
+        values, counts = self.values[appearance], self.counts[appearance]
+        top_indices = _top_indices(counts, self.k)
+        if self._tensorflow:
+            tf = _tf()
+            return tf.constant(values[top_indices]), tf.constant(counts[top_indices])
+        return values[top_indices], counts[top_indices]
+
+
+def top_k_batches(batches, k, max_counters=None):
+    top = StreamingTopK(k, max_counters)
+    for batch in batches:
+        top.update(batch)
+    return top.result()
+
+
+def get_top_elements(signal, k, backend=None):
+    return top_k(signal, k, backend)
+
+
+def precision(true, pred):
+    true_set, pred_set = set(true), set(pred)
+    if not pred_set:
+        return 0.0
+    return len(true_set & pred_set) / len(pred_set)
+
+
+def recall(true, pred):
+    true_set, pred_set = set(true), set(pred)
+    if not true_set:
+        return 0.0
+    return len(true_set & pred_set) / len(true_set)
+
+
+def f1_score(true, pred):
+    p = precision(true, pred)
+    r = recall(true, pred)
+    if p + r == 0:
+        return 0.0
+    return 2 * (p * r) / (p + r)
+
+
+def compute_threshold_leakage(signal, thresholds, backend=None):
+    # Ordena o sinal uma única vez; para cada threshold, searchsorted devolve
+    # quantos valores ficam abaixo dele, então todos os thresholds saem de uma
+    # só busca vetorizada em vez de um loop sobre o sinal inteiro
+    if _select_backend(signal, backend) == TENSORFLOW_BACKEND:
+        tf = _tf()
+        signal = tf.sort(tf.reshape(tf.cast(signal, tf.float32), [-1]))  # Converte signal para float32
+        thresholds = tf.reshape(tf.cast(thresholds, tf.float32), [-1])
+        below_threshold = tf.searchsorted(signal, thresholds, side='left')
+        above_threshold = tf.cast(tf.size(signal) - below_threshold, tf.float32)
+        false_positive_rates = above_threshold / tf.cast(tf.size(signal), tf.float32)
+        false_discovery_rates = above_threshold / tf.reduce_sum(signal)
+        return false_positive_rates, false_discovery_rates
+
+    signal = np.sort(np.asarray(signal, dtype=np.float32).reshape(-1))
+    thresholds = np.asarray(thresholds, dtype=np.float32).reshape(-1)
+    below_threshold = np.searchsorted(signal, thresholds, side='left')
+    above_threshold = (signal.size - below_threshold).astype(np.float32)
+    false_positive_rates = above_threshold / np.float32(signal.size)
+    false_discovery_rates = above_threshold / signal.sum(dtype=np.float32)
+    return false_positive_rates, false_discovery_rates
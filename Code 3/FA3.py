@@ -1,47 +1,9 @@
+import numpy as np
 import tensorflow as tf
 from tensorflow.keras.datasets import mnist
 
-# Funções de heavy_hitters_utils
-def top_k(signal, k):
-    unique, _, counts = tf.unique_with_counts(signal)
-    top_indices = tf.argsort(counts, direction='DESCENDING')[:k]
-    return tf.gather(unique, top_indices), tf.gather(counts, top_indices)
-
-def precision(true, pred):
-    true_set, pred_set = set(true), set(pred)
-    if not pred_set:
-        return 0.0
-    return len(true_set & pred_set) / len(pred_set)
-
-def recall(true, pred):
-    true_set, pred_set = set(true), set(pred)
-    if not true_set:
-        return 0.0
-    return len(true_set & pred_set) / len(true_set)
-
-def f1_score(true, pred):
-    p = precision(true, pred)
-    r = recall(true, pred)
-    if p + r == 0:
-        return 0.0
-    return 2 * (p * r) / (p + r)
-
-def compute_threshold_leakage(signal, thresholds):
-    signal = tf.cast(signal, tf.float32)  # Converte signal para float32
-    false_positive_rates = []
-    false_discovery_rates = []
-    for threshold in thresholds:
-        above_threshold = signal >= threshold
-        false_positive_rate = tf.reduce_sum(tf.cast(above_threshold, tf.float32)) / len(signal)
-        false_discovery_rate = tf.reduce_sum(tf.cast(above_threshold, tf.float32)) / tf.reduce_sum(tf.cast(signal, tf.float32))
-        false_positive_rates.append(false_positive_rate)
-        false_discovery_rates.append(false_discovery_rate)
-    return false_positive_rates, false_discovery_rates
-
-def get_top_elements(signal, k):
-    unique, _, counts = tf.unique_with_counts(signal)
-    top_indices = tf.argsort(counts, direction='DESCENDING')[:k]
-    return tf.gather(unique, top_indices), tf.gather(counts, top_indices)
+# Funções de heavy_hitters_utils (backend NumPy por padrão, TensorFlow para tf.Tensor)
+from heavy_hitters_utils import compute_threshold_leakage, f1_score, get_top_elements, precision, recall, top_k
 
 # Função para carregar o dataset MNIST
 def load_mnist_data():
@@ -66,12 +28,25 @@ class HeavyHittersTest(tf.test.TestCase):
 # Classe de teste de HeavyHittersUtils
 class HeavyHittersUtilsTest(tf.test.TestCase):
 
+    # Os sinais de teste são tf.Tensor, o que seleciona o backend TensorFlow
+    def constant(self, value):
+        return tf.constant(value)
+
     def test_top_k(self):
-        signal = tf.constant([1, 2, 2, 3, 3, 3])
+        signal = self.constant([1, 2, 2, 3, 3, 3])
         top_elements, counts = top_k(signal, 2)
         self.assertAllEqual(top_elements, [3, 2])
         self.assertAllEqual(counts, [3, 2])
 
+    def test_top_k_batches(self):
+        signal = [4, 1, 1, 7, 4, 4, 2, 7, 1, 4, 9, 7, 7]
+        for k in (1, 3, 10):
+            expected_elements, expected_counts = top_k(self.constant(signal), k)
+            batches = (self.constant(signal[i:i + 4]) for i in range(0, len(signal), 4))
+            top_elements, counts = top_k(batches, k)
+            self.assertAllEqual(top_elements, expected_elements)
+            self.assertAllEqual(counts, expected_counts)
+
     def test_precision(self):
         self.assertAlmostEqual(precision([1, 2, 3], [1, 2, 4]), 2 / 3)
         self.assertAlmostEqual(precision([1, 2, 3], [4, 5, 6]), 0.0)
@@ -88,7 +63,7 @@ class HeavyHittersUtilsTest(tf.test.TestCase):
         self.assertAlmostEqual(f1_score([1, 2, 3], [1, 2, 3]), 1.0)
 
     def test_compute_threshold_leakage(self):
-        signal = tf.constant([1, 2, 2, 3, 3, 3, 4, 4, 4, 4])
+        signal = self.constant([1, 2, 2, 3, 3, 3, 4, 4, 4, 4])
         thresholds = [1.5, 2.5, 3.5]
         expected_false_positive_rates = [0.9, 0.7, 0.4]  # Atualizados
         expected_false_discovery_rates = [0.3, 0.23333333, 0.13333334]  # Atualizados
@@ -96,12 +71,39 @@ class HeavyHittersUtilsTest(tf.test.TestCase):
         self.assertAllClose(false_positive_rates, expected_false_positive_rates)
         self.assertAllClose(false_discovery_rates, expected_false_discovery_rates)
 
+    def test_compute_threshold_leakage_many_thresholds(self):
+        signal = self.constant([5, 1, 4, 4, 2, 9, 0, 3, 3, 7])
+        thresholds = [-1.0, 0.0, 0.5, 3.0, 3.5, 4.0, 8.9, 9.0, 9.5]
+        false_positive_rates, false_discovery_rates = compute_threshold_leakage(signal, thresholds)
+        values = np.asarray(signal)
+        expected_counts = [float((values >= threshold).sum()) for threshold in thresholds]
+        self.assertAllClose(false_positive_rates, [count / len(values) for count in expected_counts])
+        self.assertAllClose(false_discovery_rates, [count / values.sum() for count in expected_counts])
+
     def test_get_top_elements(self):
-        signal = tf.constant([1, 2, 2, 3, 3, 3])
+        signal = self.constant([1, 2, 2, 3, 3, 3])
         top_elements, counts = get_top_elements(signal, 2)
         self.assertAllEqual(top_elements, [3, 2])
         self.assertAllEqual(counts, [3, 2])
 
+# Mesmos casos com arrays NumPy, que selecionam o backend NumPy
+class HeavyHittersUtilsNumpyTest(HeavyHittersUtilsTest):
+
+    def constant(self, value):
+        return np.array(value)
+
+    def test_backends_agree(self):
+        signal = [4, 1, 1, 7, 4, 4, 2, 7, 1, 4, 9]
+        for k in (1, 2, 3, 10):
+            np_elements, np_counts = top_k(np.array(signal), k)
+            tf_elements, tf_counts = top_k(tf.constant(signal), k)
+            self.assertAllEqual(np_elements, tf_elements)
+            self.assertAllEqual(np_counts, tf_counts)
+        thresholds = [0.5, 1.0, 4.0, 8.0]
+        np_rates = compute_threshold_leakage(np.array(signal), thresholds)
+        tf_rates = compute_threshold_leakage(tf.constant(signal), thresholds)
+        self.assertAllClose(np_rates, tf_rates)
+
 # Funções originais do federated5.py
 def main():
     # Carregar dataset MNIST
@@ -113,6 +115,11 @@ def main():
     print("Top K Elements (MNIST Labels):", top_elements.numpy())
     print("Counts:", counts.numpy())
 
+    # Mesmo top_k com o sinal chegando em lotes, sem montar um único tensor
+    top_elements, counts = top_k(iter(np.array_split(y_train, 10)), 5)
+    print("Top K Elements (MNIST Labels, em lotes):", top_elements)
+    print("Counts (em lotes):", counts)
+
     # Exemplo para precision, recall e f1_score
     true_labels = y_train[:1000].tolist()  # Primeiros 1000 rótulos reais
     pred_labels = y_test[:1000].tolist()   # Primeiros 1000 rótulos previstos (para demonstração)
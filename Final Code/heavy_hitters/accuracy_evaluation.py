@@ -0,0 +1,171 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from item_aggregation import ItemAggregator, ItemDictionary
+
+# Batched accuracy of federated rounds against the centralized ground truth.
+#
+# Every client is queried once, for the largest k evaluated, and its response
+# is flattened into entry arrays (client position, song ID, popularity, rank
+# in the client's list). A round is then only a boolean mask over the clients:
+# the aggregated top-k of many rounds is computed at once with one bincount
+# over (round, song) keys, with the same averages and the same first-seen tie
+# rule as aggregate_top_songs. First-seen follows each round's own client order
+# (the order select_reliable_clients returns, in which main and run_sweep
+# concatenate the responses), so tied songs resolve as in those rounds. The scores compare each round's top-k with the
+# centralized top-k, also for all rounds at once:
+#   - precision@k: share of the round's songs that are in the centralized top-k
+#   - recall@k: share of the centralized top-k the round found
+#   - F1 of the two
+#   - Spearman rank correlation of the songs found by both, NaN below 2 songs
+
+ACCURACY_COLUMNS = ['precision_at_k', 'recall_at_k', 'f1', 'rank_correlation']
+
+# Largest (rounds x entries) block aggregated at once
+_BATCH_ELEMENTS = 1 << 22
+
+
+class ClientResponses:
+    # The top songs of every client, in client order, as flat arrays
+
+    def __init__(self, client_results, dictionary=None):
+        # client_results: [(client_id, [(popularity, song)] or None)]
+        self.dictionary = dictionary if dictionary is not None else ItemDictionary()
+        self.client_ids = np.array([int(client_id) for client_id, _ in client_results], dtype=np.int64)
+        self.responded = np.array([top_songs is not None for _, top_songs in client_results], dtype=bool)
+        entries = [(position, rank, popularity, song)
+                   for position, (_, top_songs) in enumerate(client_results)
+                   for rank, (popularity, song) in enumerate(top_songs or [])]
+        positions, ranks, popularities, songs = zip(*entries) if entries else ((), (), (), ())
+        self.entry_clients = np.array(positions, dtype=np.int64)
+        self.entry_ranks = np.array(ranks, dtype=np.int64)
+        self.entry_values = np.array(popularities, dtype=np.float64)
+        self.entry_songs = self.dictionary.encode(songs)
+
+    def __len__(self):
+        return len(self.client_ids)
+
+    def client_mask(self, client_ids):
+        return np.isin(self.client_ids, np.asarray(client_ids, dtype=np.int64))
+
+    def client_order(self, client_ids):
+        # Position of every client in client_ids, the order a round aggregates in; others go last
+        order = np.full(len(self.client_ids), len(client_ids), dtype=np.int64)
+        positions = {int(client_id): position for position, client_id in enumerate(client_ids)}
+        for index, client_id in enumerate(self.client_ids):
+            order[index] = positions.get(int(client_id), len(client_ids))
+        return order
+
+    def top_k(self, masks, k, orders=None):
+        # Aggregated top-k song IDs of each round (one mask row per round); -1 pads rounds with fewer songs.
+        # orders has one client_order row per round (default: client order) and decides first-seen ties.
+        masks = np.atleast_2d(np.asarray(masks, dtype=bool))
+        num_rounds = len(masks)
+        if orders is None:
+            orders = np.arange(len(self.client_ids), dtype=np.int64)
+        orders = np.broadcast_to(np.asarray(orders, dtype=np.int64), masks.shape)
+        top_ids = np.full((num_rounds, max(k, 0)), -1, dtype=np.int64)
+        used = self.entry_ranks < k
+        clients, songs, values = self.entry_clients[used], self.entry_songs[used], self.entry_values[used]
+        ranks = self.entry_ranks[used]
+        if k <= 0 or len(songs) == 0:
+            return top_ids
+
+        num_songs = len(self.dictionary)
+        batch = max(1, _BATCH_ELEMENTS // len(songs))
+        for start in range(0, num_rounds, batch):
+            selected = masks[start:start + batch][:, clients]
+            round_index, entry_index = np.nonzero(selected)
+            keys = round_index * num_songs + songs[entry_index]
+            unique_keys, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+            sums = np.bincount(inverse, weights=values[entry_index], minlength=len(unique_keys))
+            means = sums / counts
+
+            # Position of each entry in its round's concatenated responses; a song is seen at its earliest
+            arrival = orders[start + round_index, clients[entry_index]] * k + ranks[entry_index]
+            first_seen = np.full(len(unique_keys), np.iinfo(np.int64).max, dtype=np.int64)
+            np.minimum.at(first_seen, inverse, arrival)
+
+            # Highest mean first, then first-seen, per round
+            order = np.lexsort((first_seen, -means, unique_keys // num_songs))
+            rounds = unique_keys[order] // num_songs
+            rank = np.arange(len(order)) - np.searchsorted(rounds, rounds)
+            keep = rank < k
+            top_ids[start + rounds[keep], rank[keep]] = unique_keys[order][keep] % num_songs
+        return top_ids
+
+
+def score_top_k(truth_ids, predicted_ids):
+    # truth_ids: (k,) song IDs of the centralized top-k; predicted_ids: (rounds, k) padded with -1.
+    # Returns a DataFrame with one row of ACCURACY_COLUMNS per round
+    truth_ids = np.asarray(truth_ids, dtype=np.int64)
+    predicted_ids = np.atleast_2d(np.asarray(predicted_ids, dtype=np.int64))
+    size = max(int(predicted_ids.max(initial=-1)), int(truth_ids.max(initial=-1))) + 1
+    truth_rank = np.full(size + 1, -1, dtype=np.int64)  # Last slot answers the -1 padding
+    truth_rank[truth_ids] = np.arange(len(truth_ids))
+
+    predicted = predicted_ids >= 0
+    ranks_in_truth = truth_rank[predicted_ids]
+    common = predicted & (ranks_in_truth >= 0)
+    hits = common.sum(axis=1)
+    num_predicted = predicted.sum(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(num_predicted > 0, hits / num_predicted, 0.0)
+        recall = np.where(len(truth_ids) > 0, hits / max(len(truth_ids), 1), 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+
+        # Ranks of the common songs among themselves, in the round and in the truth
+        round_rank = np.cumsum(common, axis=1) - 1
+        truth_order = np.where(common, ranks_in_truth, np.iinfo(np.int64).max)
+        truth_rank_common = (truth_order[:, None, :] < truth_order[:, :, None]).sum(axis=2)
+        squared = np.where(common, (round_rank - truth_rank_common) ** 2, 0).sum(axis=1)
+        rank_correlation = np.where(hits >= 2, 1 - 6 * squared / (hits * (hits ** 2 - 1)), np.nan)
+
+    return pd.DataFrame({'precision_at_k': precision, 'recall_at_k': recall, 'f1': f1,
+                         'rank_correlation': rank_correlation})
+
+
+def score_rounds(truth_songs, rounds_songs):
+    # Labels version of score_top_k: the centralized top-k labels and one list of labels per round
+    dictionary = ItemDictionary()
+    truth_ids = dictionary.encode(truth_songs)
+    k = max([len(truth_songs)] + [len(songs) for songs in rounds_songs])
+    predicted_ids = np.full((len(rounds_songs), k), -1, dtype=np.int64)
+    for row, songs in enumerate(rounds_songs):
+        predicted_ids[row, :len(songs)] = dictionary.encode(songs)
+    return score_top_k(truth_ids, predicted_ids)
+
+
+class AccuracyEvaluationTest(unittest.TestCase):
+
+    def test_batched_top_k_matches_each_round(self):
+        rng = np.random.default_rng(0)
+        client_results = [(client_id, [(int(rng.integers(90, 100)), f'song{song}')
+                                       for song in rng.choice(12, 4, replace=False)] if client_id != 3 else None)
+                          for client_id in range(1, 9)]
+        responses = ClientResponses(client_results)
+        rounds = [[7, 3, 4, 5, 1], [1, 2, 3], [8, 6, 2, 4], [5]]
+        masks = [responses.client_mask(client_ids) for client_ids in rounds]
+        orders = [responses.client_order(client_ids) for client_ids in rounds]
+        for k in (1, 3, 4):
+            top_ids = responses.top_k(masks, k, orders)
+            for row, client_ids in enumerate(rounds):
+                # The same round aggregated one response after the other, in the round's client order
+                aggregator = ItemAggregator()
+                for client_id in client_ids:
+                    top_songs = dict(client_results)[client_id]
+                    if top_songs:
+                        aggregator.add_items([song for _, song in top_songs[:k]],
+                                             [popularity for popularity, _ in top_songs[:k]])
+                expected = [song for song, _ in aggregator.top_k(k)]
+                predicted = [song_id for song_id in top_ids[row] if song_id >= 0]
+                self.assertEqual(responses.dictionary.decode(predicted), expected)
+
+    def test_scores(self):
+        scores = score_rounds(['a', 'b', 'c'], [['a', 'b', 'c'], ['c', 'b', 'x'], ['x'], []])
+        np.testing.assert_allclose(scores['precision_at_k'], [1, 2 / 3, 0, 0])
+        np.testing.assert_allclose(scores['recall_at_k'], [1, 2 / 3, 0, 0])
+        np.testing.assert_allclose(scores['rank_correlation'], [1, -1, np.nan, np.nan])
@@ -0,0 +1,525 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+# Columnar on-disk format for client shards.
+#
+# Each client shard is a directory with one raw file per column and a small
+# JSON manifest, so a query memory-maps only the columns it projects instead
+# of unpickling the whole DataFrame:
+#
+#   client_models/client_data_N/
+#       shard.json                 number of rows, content hash and the kind of every column
+#       track_popularity.values    int64, typed once when the shard is written
+#       track_popularity.valid     uint8, 0 where the source value was missing
+#       track_name.offsets         int64, num_rows + 1 byte offsets into .data
+#       track_name.data            uint8, utf-8 strings stored back to back
+#       track_name.valid           uint8, 0 where the source value was missing
+#       danceability.values        float64, NaN where the source value was missing
+#       track_popularity.order     int64, rows with a popularity, most popular first
+#       track_popularity.by_playlist_genre
+#                                  int64, the same order grouped by genre; the manifest
+#                                  holds each genre's [start, end) range
+#
+# The popularity index makes a top-k query, with or without a genre filter,
+# read only its first k entries. Ties keep row order, like nlargest.
+
+SHARD_DIR = 'client_models'
+MANIFEST_FILENAME = 'shard.json'
+
+# Columns always stored as typed integers, whatever dtype the CSV reader inferred
+INTEGER_COLUMNS = ('track_popularity',)
+
+# Columns read by the top songs query
+QUERY_COLUMNS = ('track_popularity', 'track_name', 'track_artist', 'playlist_genre')
+
+# Column sorted by the shard index, and the column its order is partitioned by
+INDEX_COLUMN = 'track_popularity'
+PARTITION_COLUMN = 'playlist_genre'
+
+INT_KIND = 'int'
+FLOAT_KIND = 'float'
+STRING_KIND = 'string'
+
+# Kinds from narrowest to widest; a column takes the widest kind seen in any chunk
+_KIND_ORDER = {INT_KIND: 0, FLOAT_KIND: 1, STRING_KIND: 2}
+
+
+class ShardError(Exception):
+    # A client shard that is missing or does not match its manifest
+    pass
+
+
+def client_shard_path(client_id, shard_dir=SHARD_DIR):
+    return os.path.join(shard_dir, f'client_data_{client_id}')
+
+
+def legacy_shard_path(client_id, shard_dir=SHARD_DIR):
+    return os.path.join(shard_dir, f'client_data_{client_id}.pkl')
+
+
+def _column_kind(name, column):
+    if name in INTEGER_COLUMNS or pd.api.types.is_integer_dtype(column) or pd.api.types.is_bool_dtype(column):
+        return INT_KIND
+    if pd.api.types.is_float_dtype(column):
+        return FLOAT_KIND
+    return STRING_KIND
+
+
+def text_column_kind(name, column):
+    # Kind of a column read as text (dtype=str), by the rules pandas applies to a whole file:
+    # integer literals without missing values, other numbers, or strings
+    if name in INTEGER_COLUMNS:
+        return INT_KIND
+    present = column.dropna()
+    if pd.to_numeric(present, errors='coerce').isna().any():
+        return STRING_KIND
+    if len(present) == len(column) and present.str.fullmatch(r'\s*[+-]?\d+\s*').all():
+        return INT_KIND
+    return FLOAT_KIND
+
+
+def widest_kind(*kinds):
+    return max(kinds, key=_KIND_ORDER.get)
+
+
+def _check_lossless(name, kind, column):
+    # A value that the column's kind cannot hold must not silently become missing
+    if kind == STRING_KIND or name in INTEGER_COLUMNS:
+        return
+    numeric = pd.to_numeric(column, errors='coerce')
+    lost = column.notna() & numeric.isna()
+    if kind == INT_KIND:
+        numeric = numeric.astype(np.float64)
+        lost |= numeric.notna() & (numeric != np.floor(numeric))
+    if lost.any():
+        raise ValueError(f"Column '{name}' is stored as {kind} but holds {column[lost].iloc[0]!r}; "
+                         f"pass the kinds of the whole file")
+
+
+def _encode_column(kind, column):
+    # Returns {suffix: ndarray} for one chunk of a column
+    if kind == INT_KIND:
+        numeric = pd.to_numeric(column, errors='coerce')
+        valid = numeric.notna().to_numpy()
+        values = np.zeros(len(numeric), dtype=np.int64)
+        values[valid] = numeric[valid].to_numpy().astype(np.int64)
+        return {'values': values, 'valid': valid.astype(np.uint8)}
+    if kind == FLOAT_KIND:
+        values = pd.to_numeric(column, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+        return {'values': values}
+    valid = column.notna().to_numpy()
+    encoded = [str(value).encode('utf-8') if ok else b'' for value, ok in zip(column.to_numpy(), valid)]
+    lengths = np.fromiter((len(value) for value in encoded), dtype=np.int64, count=len(encoded))
+    return {
+        'lengths': lengths,
+        'data': np.frombuffer(b''.join(encoded), dtype=np.uint8),
+        'valid': valid.astype(np.uint8),
+    }
+
+
+def encode_frame(df, columns=None):
+    # Returns ({column: kind}, {(column, suffix): ndarray}) in the shard file layout; columns
+    # fixes the kinds (e.g. those of the whole file when df is one chunk of it)
+    df = df.copy(deep=False)
+    df.columns = df.columns.str.strip()
+    if columns is None:
+        columns = {name: _column_kind(name, df[name]) for name in df.columns}
+    arrays = {}
+    for name, kind in columns.items():
+        _check_lossless(name, kind, df[name])
+        parts = _encode_column(kind, df[name])
+        if kind == STRING_KIND:
+            parts['offsets'] = np.concatenate(([0], np.cumsum(parts.pop('lengths')))).astype(np.int64)
+        for suffix, array in parts.items():
+            arrays[(name, suffix)] = array
+    return columns, arrays
+
+
+def column_layout(columns, num_rows, string_bytes):
+    # {(column, suffix): (dtype str, count)} of the arrays encode_frame returns for num_rows rows;
+    # string_bytes is {column: UTF-8 bytes of all its values}
+    layout = {}
+    for name, kind in columns.items():
+        if kind == STRING_KIND:
+            layout[(name, 'offsets')] = ('<i8', num_rows + 1)
+            layout[(name, 'data')] = ('|u1', int(string_bytes.get(name, 0)))
+            layout[(name, 'valid')] = ('|u1', num_rows)
+        elif kind == INT_KIND:
+            layout[(name, 'values')] = ('<i8', num_rows)
+            layout[(name, 'valid')] = ('|u1', num_rows)
+        else:
+            layout[(name, 'values')] = ('<f8', num_rows)
+    return layout
+
+
+def _map_file(path, dtype, count):
+    # np.memmap refuses empty files, so empty columns are plain arrays
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(count,))
+
+
+class ShardWriter:
+    # Appends DataFrame chunks to a columnar shard. The column layout is given
+    # up front ({column: kind}, e.g. from song_stream.scan_song_schema) or fixed
+    # by the first chunk. A later chunk with values that do not fit the layout
+    # raises ValueError instead of losing them.
+
+    def __init__(self, path, columns=None):
+        self.path = path
+        self.num_rows = 0
+        self.columns = None
+        self._files = {}
+        self._hashes = {}
+        self._string_sizes = {}
+        os.makedirs(path, exist_ok=True)
+        # Drop the manifest first so a half-written shard is never opened
+        manifest_path = os.path.join(path, MANIFEST_FILENAME)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        if columns is not None:
+            self._start_columns(dict(columns))
+
+    def _start_columns(self, columns):
+        self.columns = columns
+        for name, kind in columns.items():
+            if kind == STRING_KIND:
+                self._string_sizes[name] = 0
+                self._write(name, 'offsets', np.zeros(1, dtype=np.int64))
+
+    def _write(self, name, suffix, array):
+        key = (name, suffix)
+        if key not in self._files:
+            self._files[key] = open(os.path.join(self.path, f'{name}.{suffix}'), 'wb')
+            self._hashes[key] = hashlib.sha256()
+        data = np.ascontiguousarray(array).tobytes()
+        self._files[key].write(data)
+        self._hashes[key].update(data)
+
+    def content_hash(self):
+        # Hashed per file, so the same rows give the same hash however they were chunked
+        digest = hashlib.sha256(str(self.num_rows).encode())
+        for (name, suffix), file_hash in sorted(self._hashes.items()):
+            digest.update(f'{name}.{suffix}:{file_hash.hexdigest()}'.encode())
+        return digest.hexdigest()
+
+    def append(self, chunk):
+        chunk = chunk.copy(deep=False)
+        chunk.columns = chunk.columns.str.strip()
+        if self.columns is None:
+            self._start_columns({name: _column_kind(name, chunk[name]) for name in chunk.columns})
+
+        for name, kind in self.columns.items():
+            _check_lossless(name, kind, chunk[name])
+            parts = _encode_column(kind, chunk[name])
+            if kind == STRING_KIND:
+                offsets = self._string_sizes[name] + np.cumsum(parts.pop('lengths'))
+                if len(offsets):
+                    self._string_sizes[name] = int(offsets[-1])
+                parts['offsets'] = offsets
+            for suffix, array in parts.items():
+                self._write(name, suffix, array)
+        self.num_rows += len(chunk)
+
+    def _write_index(self):
+        # Returns the manifest entry of the popularity index, or None if the shard has no such column
+        if (self.columns or {}).get(INDEX_COLUMN) != INT_KIND:
+            return None
+        shard = ClientShard(self.num_rows, self.columns, path=self.path)
+        values, valid = shard.numeric(INDEX_COLUMN)
+        rows = np.flatnonzero(valid)
+        order = rows[np.argsort(-values[rows], kind='stable')]
+        index = {'rows': len(order)}
+        np.ascontiguousarray(order, dtype=np.int64).tofile(os.path.join(self.path, f'{INDEX_COLUMN}.order'))
+
+        if self.columns.get(PARTITION_COLUMN) == STRING_KIND:
+            codes, partitions = pd.factorize(pd.Series(shard.strings(PARTITION_COLUMN, order), dtype=object))
+            grouped = order[codes >= 0][np.argsort(codes[codes >= 0], kind='stable')]
+            ends = np.cumsum(np.bincount(codes[codes >= 0], minlength=len(partitions)))
+            index['partition_column'] = PARTITION_COLUMN
+            index['partitioned_rows'] = len(grouped)
+            index['partitions'] = {partition: [int(end - size), int(end)] for partition, end, size in
+                                   zip(partitions, ends, np.diff(ends, prepend=0))}
+            np.ascontiguousarray(grouped, dtype=np.int64).tofile(
+                os.path.join(self.path, f'{INDEX_COLUMN}.by_{PARTITION_COLUMN}'))
+        return index
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        manifest = {'num_rows': self.num_rows, 'content_hash': self.content_hash(), 'columns': self.columns or {}}
+        index = self._write_index()
+        if index is not None:
+            manifest['indexes'] = {INDEX_COLUMN: index}
+        with open(os.path.join(self.path, MANIFEST_FILENAME), 'w') as f:
+            json.dump(manifest, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+            return
+        # A failed write leaves no manifest, so the partial shard is never opened
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+
+def write_client_shard(df, path):
+    with ShardWriter(path) as writer:
+        writer.append(df)
+    return path
+
+
+class ClientShard:
+    # Read-only view over a columnar shard. Columns are memory-mapped lazily on
+    # first access, so a query only touches the files it projects.
+
+    def __init__(self, num_rows, columns, path=None, arrays=None, indexes=None):
+        self.num_rows = num_rows
+        self.columns = columns
+        self.path = path
+        self.indexes = indexes if indexes is not None else {}
+        self._arrays = arrays if arrays is not None else {}
+        self.bytes_mapped = 0  # Size of the column files mapped so far
+
+    @classmethod
+    def open(cls, path):
+        with open(os.path.join(path, MANIFEST_FILENAME)) as f:
+            manifest = json.load(f)
+        return cls(manifest['num_rows'], manifest['columns'], path=path, indexes=manifest.get('indexes'))
+
+    @classmethod
+    def from_frame(cls, df):
+        # In-memory shard, used for legacy pickled DataFrames
+        columns, arrays = encode_frame(df)
+        return cls(len(df), columns, arrays=arrays)
+
+    def __len__(self):
+        return self.num_rows
+
+    def _array(self, name, suffix, dtype, count):
+        key = (name, suffix)
+        if key not in self._arrays:
+            if name not in self.columns:
+                raise KeyError(name)
+            self._arrays[key] = _map_file(os.path.join(self.path, f'{name}.{suffix}'), dtype, count)
+            self.bytes_mapped += self._arrays[key].nbytes
+        return self._arrays[key]
+
+    def _string_size(self, name):
+        offsets = self._array(name, 'offsets', np.int64, self.num_rows + 1)
+        return int(offsets[-1])
+
+    def numeric(self, name):
+        # Returns (values, valid); valid is None for float columns, which use NaN
+        kind = self.columns[name]
+        if kind == INT_KIND:
+            values = self._array(name, 'values', np.int64, self.num_rows)
+            valid = self._array(name, 'valid', np.uint8, self.num_rows).view(np.bool_)
+            return values, valid
+        if kind == FLOAT_KIND:
+            return self._array(name, 'values', np.float64, self.num_rows), None
+        raise TypeError(f"Column '{name}' is not numeric")
+
+    def top_rows(self, k, partition=None):
+        # Rows of the k largest INDEX_COLUMN values (within one partition if given), from the
+        # index; None when the shard has no index
+        index = self.indexes.get(INDEX_COLUMN)
+        if index is None or (partition is not None and 'partitions' not in index):
+            return None
+        if partition is None:
+            order = self._array(INDEX_COLUMN, 'order', np.int64, index['rows'])
+            return np.asarray(order[:max(k, 0)])
+        start, end = index['partitions'].get(partition, (0, 0))
+        grouped = self._array(INDEX_COLUMN, f"by_{index['partition_column']}", np.int64, index['partitioned_rows'])
+        return np.asarray(grouped[start:min(end, start + max(k, 0))])
+
+    def strings(self, name, rows=None):
+        # Decodes only the requested rows; missing values come back as NaN like pandas
+        if self.columns[name] != STRING_KIND:
+            raise TypeError(f"Column '{name}' is not a string column")
+        offsets = self._array(name, 'offsets', np.int64, self.num_rows + 1)
+        data = self._array(name, 'data', np.uint8, self._string_size(name))
+        valid = self._array(name, 'valid', np.uint8, self.num_rows)
+        rows = range(self.num_rows) if rows is None else rows
+        decoded = []
+        for row in rows:
+            if valid[row]:
+                decoded.append(bytes(data[offsets[row]:offsets[row + 1]]).decode('utf-8'))
+            else:
+                decoded.append(np.nan)
+        return decoded
+
+    def to_frame(self, columns=None):
+        columns = list(self.columns) if columns is None else list(columns)
+        data = {}
+        for name in columns:
+            kind = self.columns[name]
+            if kind == STRING_KIND:
+                data[name] = pd.Series(self.strings(name), dtype=object)
+            else:
+                values, valid = self.numeric(name)
+                if valid is None:
+                    data[name] = pd.Series(np.asarray(values))
+                else:
+                    data[name] = pd.arrays.IntegerArray(np.array(values), ~np.asarray(valid))
+        return pd.DataFrame(data)
+
+
+def shard_content_hash(client_id, shard_dir=SHARD_DIR):
+    # Identifies the shard's content without loading it: columnar shards carry the hash in
+    # their manifest, legacy pickles are hashed from their bytes. None when there is no shard.
+    manifest_path = os.path.join(client_shard_path(client_id, shard_dir), MANIFEST_FILENAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            return json.load(f)['content_hash']
+    legacy_path = legacy_shard_path(client_id, shard_dir)
+    if os.path.exists(legacy_path):
+        digest = hashlib.sha256()
+        with open(legacy_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+    return None
+
+
+def open_client_shard(client_id, shard_dir=SHARD_DIR):
+    # Columnar shards take precedence; pickles written by older runs still load.
+    # Returns None when the client has no shard at all.
+    path = client_shard_path(client_id, shard_dir)
+    if os.path.exists(os.path.join(path, MANIFEST_FILENAME)):
+        return ClientShard.open(path)
+    legacy_path = legacy_shard_path(client_id, shard_dir)
+    if os.path.exists(legacy_path):
+        with open(legacy_path, 'rb') as f:
+            return ClientShard.from_frame(pickle.load(f))
+    return None
+
+
+def _expected_file_sizes(path, manifest):
+    # {file path: size in bytes} of every column and index file the manifest implies
+    num_rows = int(manifest['num_rows'])
+    sizes = {}
+    for name, kind in manifest['columns'].items():
+        if kind == STRING_KIND:
+            offsets_path = os.path.join(path, f'{name}.offsets')
+            sizes[offsets_path] = (num_rows + 1) * 8
+            if os.path.exists(offsets_path) and os.path.getsize(offsets_path) == (num_rows + 1) * 8:
+                sizes[os.path.join(path, f'{name}.data')] = int(
+                    np.fromfile(offsets_path, dtype=np.int64, count=1, offset=num_rows * 8)[0])
+            sizes[os.path.join(path, f'{name}.valid')] = num_rows
+        elif kind == INT_KIND:
+            sizes[os.path.join(path, f'{name}.values')] = num_rows * 8
+            sizes[os.path.join(path, f'{name}.valid')] = num_rows
+        elif kind == FLOAT_KIND:
+            sizes[os.path.join(path, f'{name}.values')] = num_rows * 8
+        else:
+            raise ValueError(f"Unknown kind '{kind}' of column '{name}'")
+    index = manifest.get('indexes', {}).get(INDEX_COLUMN)
+    if index is not None:
+        sizes[os.path.join(path, f'{INDEX_COLUMN}.order')] = int(index['rows']) * 8
+        if 'partitions' in index:
+            sizes[os.path.join(path, f"{INDEX_COLUMN}.by_{index['partition_column']}")] = \
+                int(index['partitioned_rows']) * 8
+    return sizes
+
+
+def validate_client_shard(client_id, shard_dir=SHARD_DIR):
+    # Checks a shard without mapping it: the manifest parses and every file it implies has the
+    # expected size. Returns the content hash; raises ShardError for a missing or corrupt shard.
+    # Legacy pickles are only checked when they are loaded.
+    path = client_shard_path(client_id, shard_dir)
+    manifest_path = os.path.join(path, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        if os.path.exists(legacy_shard_path(client_id, shard_dir)):
+            return shard_content_hash(client_id, shard_dir)
+        raise ShardError(f"Client {client_id} has no shard in {shard_dir}")
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        content_hash = manifest['content_hash']
+        sizes = _expected_file_sizes(path, manifest)
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise ShardError(f"Corrupt manifest {manifest_path}: {e!r}") from e
+    for file_path, size in sizes.items():
+        # Empty columns may have no file at all
+        actual = os.path.getsize(file_path) if os.path.exists(file_path) else 0 if size == 0 else None
+        if actual is None:
+            raise ShardError(f"Missing shard file {file_path}")
+        if actual != size:
+            raise ShardError(f"Shard file {file_path} has {actual} bytes, expected {size}")
+    return content_hash
+
+
+class ClientShardTest(unittest.TestCase):
+
+    def setUp(self):
+        self.shard_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.shard_dir)
+        self.songs = pd.DataFrame({
+            'track_name': ['a', 'b', None, 'd', 'é', 'f'],
+            'track_popularity': [10, 90, 50, None, 90, 70],
+            'playlist_genre': ['pop', 'rock', 'pop', 'pop', 'rock', 'pop'],
+            'danceability': [0.5, None, 0.1, 0.2, 0.3, 0.4],
+        })
+
+    def write(self, client_id, frames, columns=None):
+        with ShardWriter(client_shard_path(client_id, self.shard_dir), columns) as writer:
+            for frame in frames:
+                writer.append(frame)
+        return open_client_shard(client_id, self.shard_dir)
+
+    def test_chunked_shard_round_trip(self):
+        whole = self.write(1, [self.songs])
+        chunked = self.write(2, [self.songs.iloc[:2], self.songs.iloc[2:5], self.songs.iloc[5:]])
+        self.assertEqual(whole.columns, {'track_name': STRING_KIND, 'track_popularity': INT_KIND,
+                                         'playlist_genre': STRING_KIND, 'danceability': FLOAT_KIND})
+        self.assertEqual(shard_content_hash(1, self.shard_dir), shard_content_hash(2, self.shard_dir))
+        names = chunked.strings('track_name')
+        self.assertTrue(pd.isna(names[2]))
+        self.assertEqual(names[:2] + names[3:], ['a', 'b', 'd', 'é', 'f'])
+        frame = chunked.to_frame()
+        self.assertEqual(frame['track_popularity'].isna().tolist(), [False, False, False, True, False, False])
+        np.testing.assert_array_equal(frame['danceability'].to_numpy(), self.songs['danceability'].to_numpy())
+
+    def test_popularity_index(self):
+        shard = self.write(1, [self.songs])
+        self.assertEqual(shard.top_rows(3).tolist(), [1, 4, 5])
+        self.assertEqual(shard.top_rows(2, 'pop').tolist(), [5, 2])
+        self.assertEqual(shard.top_rows(2, 'jazz').tolist(), [])
+
+    def test_later_chunk_that_does_not_fit_raises(self):
+        # The first chunk alone reads as integers
+        chunks = [pd.DataFrame({'track_album_release_date': [2019, 2020]}),
+                  pd.DataFrame({'track_album_release_date': ['2019-05-01']})]
+        with self.assertRaises(ValueError):
+            self.write(1, chunks)
+        self.assertIsNone(open_client_shard(1, self.shard_dir))
+        text_chunks = [chunk.astype(str) for chunk in chunks]
+        kind = widest_kind(*(text_column_kind('track_album_release_date', chunk['track_album_release_date'])
+                             for chunk in text_chunks))
+        shard = self.write(2, text_chunks, {'track_album_release_date': kind})
+        self.assertEqual(shard.strings('track_album_release_date'), ['2019', '2020', '2019-05-01'])
+
+    def test_validate_detects_truncated_file(self):
+        self.write(1, [self.songs])
+        self.assertEqual(validate_client_shard(1, self.shard_dir), shard_content_hash(1, self.shard_dir))
+        path = os.path.join(client_shard_path(1, self.shard_dir), 'track_name.data')
+        with open(path, 'r+b') as f:
+            f.truncate(2)
+        with self.assertRaises(ShardError):
+            validate_client_shard(1, self.shard_dir)
+        with self.assertRaises(ShardError):
+            validate_client_shard(2, self.shard_dir)
@@ -0,0 +1,152 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+# Exact distributed top-k with the three-phase uniform threshold protocol (TPUT).
+#
+# The global score of an item is the sum of its non-negative local scores over
+# all clients. Instead of every client shipping all of its items:
+#
+#   1. every client sends its local top-k; the k-th largest partial sum is tau1
+#   2. every client sends the items it has not sent yet with score >= tau1 / m
+#      (m clients); an item's global score is then at most its partial sum plus
+#      tau1 / m for each client that did not report it, so every item whose
+#      bound is below the k-th largest partial sum (tau2) is pruned
+#   3. the clients send their exact scores for the remaining candidates only
+#
+# The result is the exact global top-k. Each client counts the items and bytes
+# it sends (the item label as UTF-8 plus an 8-byte score).
+
+SCORE_BYTES = 8
+
+
+def response_bytes(items):
+    return sum(len(str(item).encode('utf-8')) + SCORE_BYTES for item in items)
+
+
+class TopKClient:
+    # One client's local scores, aggregated per distinct item
+
+    def __init__(self, client_id, items, scores):
+        codes, unique_items = pd.factorize(np.asarray(items, dtype=object))
+        self.client_id = client_id
+        self.items = np.asarray(unique_items, dtype=object)
+        self.scores = np.bincount(codes, weights=np.asarray(scores, dtype=np.float64), minlength=len(unique_items))
+        if np.any(self.scores < 0):
+            raise ValueError("TPUT requires non-negative scores")
+        self.positions = {item: position for position, item in enumerate(self.items)}
+        self.sent = np.zeros(len(self.items), dtype=bool)
+        self.items_sent = 0
+        self.bytes_sent = 0
+
+    def _send(self, positions):
+        positions = positions[~self.sent[positions]]
+        self.sent[positions] = True
+        items = self.items[positions].tolist()
+        self.items_sent += len(items)
+        self.bytes_sent += response_bytes(items)
+        return dict(zip(items, self.scores[positions].tolist()))
+
+    def local_top_k(self, k):
+        # Phase 1; ties keep the first-seen item
+        order = np.argsort(-self.scores, kind='stable')[:k]
+        return self._send(order)
+
+    def above(self, threshold):
+        # Phase 2: unsent items with score >= threshold
+        return self._send(np.flatnonzero(self.scores >= threshold))
+
+    def lookup(self, items):
+        # Phase 3: exact scores of the requested items this client holds and has not sent
+        positions = np.array([self.positions[item] for item in items if item in self.positions], dtype=np.int64)
+        return self._send(positions)
+
+    def full_bytes(self):
+        # Upload cost of shipping every item instead
+        return response_bytes(self.items)
+
+
+def _kth_largest(values, k):
+    values = np.fromiter(values, dtype=np.float64)
+    if len(values) < k:
+        return 0.0
+    return float(np.partition(values, len(values) - k)[len(values) - k])
+
+
+def tput_top_k(clients, k):
+    # Returns [(item, global score)] in descending order; ties keep the first-reported item
+    if k <= 0 or not clients:
+        return []
+    partial_sums = {}
+    reporters = {}
+
+    def collect(client, response):
+        for item, score in response.items():
+            partial_sums[item] = partial_sums.get(item, 0.0) + score
+            reporters.setdefault(item, set()).add(client.client_id)
+
+    for client in clients:
+        collect(client, client.local_top_k(k))
+    threshold = _kth_largest(partial_sums.values(), k) / len(clients)
+
+    for client in clients:
+        collect(client, client.above(threshold))
+    tau2 = _kth_largest(partial_sums.values(), k)
+    candidates = [item for item, partial_sum in partial_sums.items()
+                  if partial_sum + threshold * (len(clients) - len(reporters[item])) >= tau2]
+
+    for client in clients:
+        missing = [item for item in candidates if client.client_id not in reporters[item]]
+        if missing:
+            collect(client, client.lookup(missing))
+
+    scores = np.array([partial_sums[item] for item in candidates])
+    order = np.argsort(-scores, kind='stable')[:k]
+    return [(candidates[i], float(scores[i])) for i in order]
+
+
+def communication_report(clients):
+    # Items and bytes each client sent, next to the cost of shipping all of its items
+    return pd.DataFrame([{
+        'client_id': client.client_id,
+        'items_sent': client.items_sent,
+        'bytes_sent': client.bytes_sent,
+        'distinct_items': len(client.items),
+        'full_bytes': client.full_bytes(),
+    } for client in clients])
+
+
+class TputTest(unittest.TestCase):
+
+    def make_clients(self, seed):
+        rng = np.random.default_rng(seed)
+        clients = []
+        for client_id in range(1, 9):
+            items = [f'song{value}' for value in rng.zipf(1.5, 300) % 500]
+            clients.append(TopKClient(client_id, items, rng.random(len(items)) * 100))
+        return clients
+
+    def test_matches_exact_top_k(self):
+        for seed in range(5):
+            clients = self.make_clients(seed)
+            totals = {}
+            for client in clients:
+                for item, score in zip(client.items, client.scores):
+                    totals[item] = totals.get(item, 0.0) + score
+            for k in (1, 3, 10):
+                exact = sorted(totals.items(), key=lambda entry: -entry[1])[:k]
+                result = tput_top_k(self.make_clients(seed), k)
+                self.assertEqual([item for item, _ in result], [item for item, _ in exact])
+                np.testing.assert_allclose([score for _, score in result], [score for _, score in exact])
+
+    def test_sends_less_than_everything(self):
+        clients = self.make_clients(0)
+        tput_top_k(clients, 3)
+        report = communication_report(clients)
+        self.assertLess(report['bytes_sent'].sum(), report['full_bytes'].sum())
+        self.assertTrue((report['items_sent'] <= report['distinct_items']).all())
+
+    def test_rejects_negative_scores(self):
+        with self.assertRaises(ValueError):
+            TopKClient(1, ['a', 'b'], [1.0, -2.0])
@@ -1,54 +1,373 @@
+import argparse
+import glob
+import json
+import numpy as np
 import pandas as pd
-import pickle
 import os
+import pickle
 import matplotlib.pyplot as plt
 import textwrap
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from accuracy_evaluation import ACCURACY_COLUMNS, ClientResponses, score_top_k
+from distributed_top_k import TopKClient, communication_report, tput_top_k
+from federated_query import Query, federated_query
+from item_aggregation import ItemAggregator
+from tree_aggregation import aggregate_top_songs_tree
+from wire_format import WireLink, packets_for_payload, payload_report
+from client_shards import (SHARD_DIR, ShardError, ShardWriter, client_shard_path, open_client_shard,
+                           shard_content_hash, validate_client_shard, write_client_shard)
+from query_cache import DEFAULT_CACHE_BYTES, open_query_cache
+from round_checkpoint import CHECKPOINT_SUFFIX, RoundCheckpoint, file_signature
+from round_profiler import RoundProfiler
+from shared_dataset import SharedDataset
+from round_simulator import client_links, load_network_results, simulate_round
+from song_stream import (DATASET_FILENAME, DEFAULT_CHUNKSIZE, find_top_songs_streaming, read_song_chunks,
+                         scan_song_schema)
+
+# Disabled profiler used when instrumentation is switched off
+NULL_PROFILER = RoundProfiler()
+
+# Consolidated output of the multi-scenario sweep
+SWEEP_RESULTS_FILENAME = 'fa_ns3_sweep_results.csv'
+SWEEP_COLUMNS = ['scenario', 'min_limit', 'num_clients', 'num_selected_clients', 'rank', 'song', 'averaged_popularity']
+
+# Accuracy of many federated rounds against the centralized top-k
+EVALUATION_RESULTS_FILENAME = 'fa_ns3_accuracy_results.csv'
+EVALUATION_COLUMNS = ['scenario', 'min_limit', 'k', 'seed', 'num_clients', 'num_selected_clients',
+                      'num_delivered_clients'] + ACCURACY_COLUMNS
 
 # Define a custom exception for exceeding client count
 class ClientCountError(Exception):
     pass
 
-def distribute_data(df, num_clients):
-    total_rows = len(df)
+def client_row_ranges(total_rows, num_clients):
+    # Contiguous [start, end) row ranges per client; the last client also takes the remaining rows
     rows_per_client = total_rows // num_clients
-    client_data = []
-    dataset_sizes = {}
-
-    # Create directory if it doesn't exist
-    os.makedirs('client_models', exist_ok=True)
-
-    # Distribute rows to clients
+    ranges = []
     start_idx = 0
     for client_id in range(1, num_clients + 1):
-        end_idx = min(start_idx + rows_per_client, total_rows)
-        client_df = df.iloc[start_idx:end_idx].copy()  # Copy to avoid modifying the original df
-        client_filename = f'client_models/client_data_{client_id}.pkl'
-        with open(client_filename, 'wb') as f:
-            pickle.dump(client_df, f)
-        client_data.append(client_df)
-        dataset_sizes[client_id] = len(client_df)  # Track size
+        end_idx = total_rows if client_id == num_clients else min(start_idx + rows_per_client, total_rows)
+        ranges.append((start_idx, end_idx))
         start_idx = end_idx
+    return ranges
+
+def distribute_data(df, num_clients, shard_dir=SHARD_DIR):
+    client_shards = []
+    dataset_sizes = {}
+
+    # Create directory if it doesn't exist
+    os.makedirs(shard_dir, exist_ok=True)
 
-    # Handle remaining rows if any
-    if start_idx < total_rows:
-        last_client_df = pd.concat([client_data[-1], df.iloc[start_idx:]])
-        client_data[-1] = last_client_df
-        dataset_sizes[num_clients] = len(last_client_df)  # Update size for the last client
+    # Distribute rows to clients as columnar shards
+    for client_id, (start_idx, end_idx) in enumerate(client_row_ranges(len(df), num_clients), start=1):
+        client_path = write_client_shard(df.iloc[start_idx:end_idx], client_shard_path(client_id, shard_dir))
+        client_shards.append(client_path)
+        dataset_sizes[client_id] = end_idx - start_idx  # Track size
 
-    return client_data, dataset_sizes
+    return client_shards, dataset_sizes
 
-def find_top_songs(client_df):
-    client_df['track_popularity'] = pd.to_numeric(client_df['track_popularity'], errors='coerce').astype('Int64')
-    top_indices = client_df['track_popularity'].nlargest(3).index
+def distribute_csv(filename, num_clients, shard_dir=SHARD_DIR, chunksize=DEFAULT_CHUNKSIZE, checkpoint=None):
+    # Same distribution as distribute_data, but streams the CSV and writes shards one chunk at a time.
+    # With a RoundCheckpoint, shards a previous run already wrote are kept and each new one is recorded.
+    client_shards = []
+    dataset_sizes = {}
+    os.makedirs(shard_dir, exist_ok=True)
+
+    # Column kinds are fixed for the whole file, so every chunk and every client gets the same layout
+    total_rows, columns = (checkpoint.total_rows, checkpoint.columns) if checkpoint is not None else (None, None)
+    if total_rows is None:
+        total_rows, columns = scan_song_schema(filename, chunksize)
+        if checkpoint is not None:
+            checkpoint.record_total_rows(total_rows, columns)
+    ranges = client_row_ranges(total_rows, num_clients)
+    done = checkpoint.distributed_clients(shard_dir) if checkpoint is not None else {}
+    if all(client_id in done for client_id in range(1, num_clients + 1)):
+        # Nothing left to write, so the CSV is not read at all
+        return ([client_shard_path(client_id, shard_dir) for client_id in range(1, num_clients + 1)],
+                {client_id: done[client_id] for client_id in range(1, num_clients + 1)})
+
+    def open_writer(client_id):
+        # None for a client whose shard is already written; its rows are read and skipped
+        return None if client_id in done else ShardWriter(client_shard_path(client_id, shard_dir), columns)
+
+    def close_writer(client_id, writer):
+        if writer is None:
+            client_shards.append(client_shard_path(client_id, shard_dir))
+            dataset_sizes[client_id] = done[client_id]
+            return
+        writer.close()
+        client_shards.append(writer.path)
+        dataset_sizes[client_id] = writer.num_rows
+        if checkpoint is not None:
+            checkpoint.record_distributed(client_id, writer.content_hash(), writer.num_rows)
+
+    client_id = 1
+    writer = open_writer(client_id)
+    chunk_start = 0
+    for chunk in read_song_chunks(filename, chunksize, dtype=str):
+        position = 0
+        while position < len(chunk):
+            # Rows of this chunk that belong to the current client
+            end_idx = ranges[client_id - 1][1]
+            take = min(len(chunk) - position, end_idx - (chunk_start + position))
+            if take > 0:
+                if writer is not None:
+                    writer.append(chunk.iloc[position:position + take])
+                position += take
+            if chunk_start + position >= end_idx and client_id < num_clients:
+                close_writer(client_id, writer)
+                client_id += 1
+                writer = open_writer(client_id)
+        chunk_start += len(chunk)
+
+    # Close the last client and write empty shards for any client the file did not reach
+    while True:
+        close_writer(client_id, writer)
+        if client_id == num_clients:
+            break
+        client_id += 1
+        writer = open_writer(client_id)
+
+    return client_shards, dataset_sizes
+
+def distribute_shared(filename, num_clients, chunksize=DEFAULT_CHUNKSIZE):
+    # Zero-copy distribution: the catalogue is encoded once, chunk by chunk, into shared memory and every
+    # client is a row range of it. Returns (shared dataset, client row ranges, dataset sizes); the caller
+    # closes the dataset.
+    dataset = SharedDataset.from_csv(filename, chunksize)
+    ranges = client_row_ranges(dataset.num_rows, num_clients)
+    dataset_sizes = {client_id: end_idx - start_idx for client_id, (start_idx, end_idx) in enumerate(ranges, start=1)}
+    return dataset, ranges, dataset_sizes
+
+def find_top_songs(shard, k=3, genre=None):
+    # With genre, only songs of that playlist_genre are considered
+    if len(shard) == 0 or k <= 0:
+        return []
+
+    popularity, valid = shard.numeric('track_popularity')
+    top_indices = shard.top_rows(k, genre)
+    if top_indices is None:
+        # No index (legacy or in-memory shard): scan the projected columns
+        candidates = np.flatnonzero(valid)
+        if genre is not None:
+            genres = shard.strings('playlist_genre', candidates)
+            candidates = candidates[np.array([track_genre == genre for track_genre in genres], dtype=bool)]
+        values = popularity[candidates]
+
+        # Keep only rows tied with or above the k-th largest value before sorting
+        if len(values) > k:
+            kth_value = np.partition(values, len(values) - k)[len(values) - k]
+            keep = values >= kth_value
+            candidates, values = candidates[keep], values[keep]
+
+        # Stable descending sort keeps the first row on ties, like nlargest
+        top_indices = candidates[np.argsort(-values, kind='stable')[:k]]
+    song_titles = shard.strings('track_name', top_indices)
+    artist_names = shard.strings('track_artist', top_indices)
+    track_genres = shard.strings('playlist_genre', top_indices)
     top_songs = []
-    for idx in top_indices:
-        song_title = client_df.loc[idx, 'track_name']
-        artist_name = client_df.loc[idx, 'track_artist']
-        track_genre = client_df.loc[idx, 'playlist_genre']
-        popularity = client_df.loc[idx, 'track_popularity']
-        top_songs.append((popularity, f"{song_title} - {artist_name} ({track_genre})"))
+    for idx, song_title, artist_name, track_genre in zip(top_indices, song_titles, artist_names, track_genres):
+        top_songs.append((int(popularity[idx]), f"{song_title} - {artist_name} ({track_genre})"))
     return top_songs
 
+def song_scores(shard, column='track_popularity', genre=None):
+    # Per-row (song labels, scores) for the exact distributed top-k; rows without a score are skipped.
+    # With genre, only songs of that playlist_genre are scored.
+    values, valid = shard.numeric(column)
+    rows = np.arange(len(shard)) if valid is None else np.flatnonzero(valid)
+    if genre is not None:
+        genres = shard.strings('playlist_genre', rows)
+        rows = rows[np.array([track_genre == genre for track_genre in genres], dtype=bool)]
+    labels = [f"{song_title} - {artist_name} ({track_genre})" for song_title, artist_name, track_genre in
+              zip(shard.strings('track_name', rows), shard.strings('track_artist', rows),
+                  shard.strings('playlist_genre', rows))]
+    return labels, np.asarray(values[rows], dtype=np.float64)
+
+def exact_top_songs(client_ids, k=3, shard_dir=SHARD_DIR, dataset=None, ranges=None, genre=None):
+    # Exact global top-k songs by total popularity over the clients, with TPUT instead of a fixed
+    # local top-3; returns (top songs, per-client communication report).
+    # With a shared dataset, clients are its views over ranges instead of shard files.
+    clients = []
+    for client_id in client_ids:
+        if dataset is not None:
+            client_shard = dataset.client_shard(*ranges[int(client_id) - 1])
+        else:
+            client_shard = open_client_shard(int(client_id), shard_dir)
+        if client_shard is not None and len(client_shard) > 0:
+            clients.append(TopKClient(int(client_id), *song_scores(client_shard, genre=genre)))
+    return tput_top_k(clients, k), communication_report(clients)
+
+def query_client(client_id, shard_dir=SHARD_DIR, k=3, cache_dir=None, cache_bytes=DEFAULT_CACHE_BYTES,
+                 profiler=NULL_PROFILER, genre=None):
+    # Per-client work: load the shard and run the query. Only the small top-k list is returned.
+    # With a cache_dir, an unchanged shard is answered from the cache without being opened.
+    cache = None
+    query = 'top_songs' if genre is None else f'top_songs:{genre}'
+    if cache_dir is not None:
+        with profiler.stage('cache_lookup', client_id):
+            content_hash = shard_content_hash(client_id, shard_dir)
+            top_songs = None
+            if content_hash is not None:
+                cache = open_query_cache(cache_dir, cache_bytes)
+                top_songs = cache.get(content_hash, query, k)
+        if content_hash is None:
+            return client_id, None
+        if top_songs is not None:
+            return client_id, top_songs
+
+    with profiler.stage('shard_load', client_id):
+        client_shard = open_client_shard(client_id, shard_dir)
+    if client_shard is None:
+        return client_id, None
+    with profiler.stage('find_top_songs', client_id) as record:
+        top_songs = find_top_songs(client_shard, k, genre)
+        record['bytes_read'] = client_shard.bytes_mapped  # Memory-mapped reads are not seen by /proc/self/io
+    if cache is not None:
+        cache.put(content_hash, query, k, top_songs)
+    return client_id, top_songs
+
+def profiled_query_client(client_id, trace_memory=True, **kwargs):
+    # query_client with its own profiler, so per-client records come back from pool workers
+    profiler = RoundProfiler(enabled=True, trace_memory=trace_memory)
+    client_id, top_songs = query_client(client_id, profiler=profiler, **kwargs)
+    return client_id, top_songs, profiler.records
+
+def checked_query_client(client_id, worker=query_client, shard_dir=SHARD_DIR):
+    # Runs worker(client_id) after checking the shard; returns (worker result, None) or
+    # (None, error) for a missing or corrupt shard instead of skipping the client
+    try:
+        validate_client_shard(client_id, shard_dir)
+        return worker(client_id), None
+    except (ShardError, OSError, ValueError, KeyError, EOFError, pickle.UnpicklingError) as e:
+        return None, str(e)
+
+def query_clients(client_ids, num_workers=1, shard_dir=SHARD_DIR, k=3, cache_dir=None, cache_bytes=DEFAULT_CACHE_BYTES,
+                  profiler=NULL_PROFILER, genre=None, failures=None):
+    # Returns [(client_id, top_songs or None)] in the order of client_ids, serially or in a process pool.
+    # With a failures dict, shards are checked first and {client_id: error} is filled in for the failed ones.
+    client_ids = [int(client_id) for client_id in client_ids]
+    worker = partial(query_client, shard_dir=shard_dir, k=k, cache_dir=cache_dir, cache_bytes=cache_bytes, genre=genre)
+    if profiler.enabled:
+        worker = partial(profiled_query_client, trace_memory=profiler.trace_memory, shard_dir=shard_dir, k=k,
+                         cache_dir=cache_dir, cache_bytes=cache_bytes, genre=genre)
+    if failures is not None:
+        worker = partial(checked_query_client, worker=worker, shard_dir=shard_dir)
+    if num_workers <= 1 or len(client_ids) <= 1:
+        results = [worker(client_id) for client_id in client_ids]
+    else:
+        chunksize = max(1, len(client_ids) // (num_workers * 4))
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            results = list(executor.map(worker, client_ids, chunksize=chunksize))
+    if failures is not None:
+        for client_id, (_, error) in zip(client_ids, results):
+            if error is not None:
+                failures[client_id] = error
+        results = [result if error is None else (client_id, None, []) if profiler.enabled else (client_id, None)
+                   for client_id, (result, error) in zip(client_ids, results)]
+    if profiler.enabled:
+        for _, _, records in results:
+            profiler.add_records(records)
+        results = [(client_id, top_songs) for client_id, top_songs, _ in results]
+    return results
+
+def checkpointed_query_clients(client_ids, checkpoint, num_workers=1, shard_dir=SHARD_DIR, k=3, cache_dir=None,
+                               cache_bytes=DEFAULT_CACHE_BYTES, genre=None):
+    # query_clients that skips the clients the checkpoint already has a response for and records each
+    # response or failure as it arrives, so a crash loses at most the clients still in flight.
+    # Returns ([(client_id, top_songs or None)], {client_id: error}) in the order of client_ids.
+    client_ids = [int(client_id) for client_id in client_ids]
+    pending = [client_id for client_id in client_ids if client_id not in checkpoint.responses]
+    worker = partial(checked_query_client, shard_dir=shard_dir,
+                     worker=partial(query_client, shard_dir=shard_dir, k=k, cache_dir=cache_dir,
+                                    cache_bytes=cache_bytes, genre=genre))
+    executor = None
+    if num_workers > 1 and len(pending) > 1:
+        executor = ProcessPoolExecutor(max_workers=num_workers)
+    try:
+        # Results come back in order, one small chunk at a time
+        results = map(worker, pending) if executor is None else \
+            executor.map(worker, pending, chunksize=max(1, min(16, len(pending) // (num_workers * 4))))
+        for client_id, (result, error) in zip(pending, results):
+            if error is None:
+                checkpoint.record_response(client_id, result[1])
+            else:
+                checkpoint.record_failure(client_id, error)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    failures = {client_id: checkpoint.failures[client_id] for client_id in client_ids
+                if client_id in checkpoint.failures}
+    return [(client_id, checkpoint.responses.get(client_id)) for client_id in client_ids], failures
+
+# Shared datasets attached by this worker process, by shared memory name
+_attached_datasets = {}
+
+def query_shared_client(client_id, row_range, spec, k=3, genre=None):
+    # Worker side of query_shared_clients: attaches to the block once per process and queries a view
+    dataset = _attached_datasets.get(spec[0])
+    if dataset is None:
+        dataset = _attached_datasets[spec[0]] = SharedDataset.attach(spec)
+    return client_id, find_top_songs(dataset.client_shard(*row_range), k, genre)
+
+def query_shared_view(client_id, dataset, ranges, k=3, genre=None):
+    # query_client over a view of a SharedDataset this process already holds
+    return client_id, find_top_songs(dataset.client_shard(*ranges[int(client_id) - 1]), k, genre)
+
+def query_shared_clients(dataset, ranges, client_ids, num_workers=1, k=3, genre=None):
+    # Same as query_clients over a SharedDataset; workers receive only the dataset spec and a row range
+    client_ids = [int(client_id) for client_id in client_ids]
+    client_ranges = [ranges[client_id - 1] for client_id in client_ids]
+    if num_workers <= 1 or len(client_ids) <= 1:
+        return [query_shared_view(client_id, dataset, ranges, k, genre) for client_id in client_ids]
+    chunksize = max(1, len(client_ids) // (num_workers * 4))
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        return list(executor.map(partial(query_shared_client, spec=dataset.spec(), k=k, genre=genre), client_ids, client_ranges,
+                                 chunksize=chunksize))
+
+def select_reliable_clients(results_df, min_limit, response_packets=None):
+    # Clients that delivered at least min_limit of the packets they sent. With response_packets
+    # ({client_id: packets}), a client's response must arrive whole: all of its packets are delivered
+    # with probability (Rx / Tx) ** packets, which must reach min_limit.
+    if response_packets is None:
+        filtered_clients = results_df[results_df['Rx_Packets'] >= abs(min_limit) * results_df['Tx_Packets']]
+        return filtered_clients['Client'].unique()
+    tx_packets = results_df['Tx_Packets'].where(results_df['Tx_Packets'] > 0)
+    delivery_ratio = (results_df['Rx_Packets'] / tx_packets).fillna(1.0)
+    packets = results_df['Client'].map(response_packets).fillna(1)
+    filtered_clients = results_df[delivery_ratio ** packets >= abs(min_limit)]
+    return filtered_clients['Client'].unique()
+
+def transmit_responses(client_results, results_df, min_limit, compress=False, links=None):
+    # Encodes each response in the wire format, drops the clients whose response needs more
+    # packets than their link can deliver, and decodes the rest at the server.
+    # links ({client_id: WireLink}) carries each link's dictionaries from one round to the next.
+    # Returns ([(client_id, top_songs)], payload report).
+    links = {} if links is None else links
+    payloads = {}
+    for client_id, top_songs in client_results:
+        if top_songs is not None:
+            payloads[client_id] = links.setdefault(client_id, WireLink()).send_top_songs(top_songs, compress)
+    response_packets = {client_id: packets_for_payload(len(payload)) for client_id, payload in payloads.items()}
+    delivered = set(select_reliable_clients(results_df, min_limit, response_packets).tolist())
+
+    # The server only sees, and its dictionaries only learn from, the payloads that arrived
+    received = []
+    for client_id, payload in payloads.items():
+        if client_id in delivered:
+            received.append((client_id, links[client_id].deliver(payload)))
+        else:
+            links[client_id].lose()
+    return received, payload_report(payloads)
+
+def aggregate_top_songs(results_from_clients, k=3):
+    # Average popularity per song over integer-encoded songs; returns [(song, average)] in descending order
+    popularities, songs = zip(*results_from_clients)
+    aggregator = ItemAggregator()
+    aggregator.add_items(songs, popularities)
+    return aggregator.top_k(k, statistic='mean')
+
 def plot_song_popularity(song_popularity, basename):
     if not song_popularity:
         print("No song popularity data to plot.")
@@ -96,107 +415,426 @@ def plot_song_popularity(song_popularity, basename):
     plt.savefig(f'{basename}_aggregated_song_popularity.png')
     plt.close()
 
-def main():
-    # Read datasets
-    df = pd.read_csv('spotify_songs.csv', low_memory=False)   
-    results_filename = '0.5_fa_ns3_results.csv'			 # The filename for results CSV and output graph
-    results_df = pd.read_csv(results_filename)
-
-    # Strip whitespace from column names
-    df.columns = df.columns.str.strip()
-    results_df.columns = results_df.columns.str.strip()
+def main(num_workers=1, chunksize=DEFAULT_CHUNKSIZE, async_round=False, deadline=None,
+         straggler_cutoff=1.0, seed=0, cache_dir=None, cache_bytes=DEFAULT_CACHE_BYTES, profile=False,
+         fan_out=None, exact_k=None, wire_format=False, compress=False,
+         shared_memory=False, genre=None, query=None, results_filename='0.5_fa_ns3_results.csv', checkpoint=False):
+    # Read datasets; the songs catalogue is streamed in chunks by distribute_csv.
+    # results_filename is the ns-3 (or network_model.py) results CSV and names the output graph.
+    # With checkpoint, the round is logged next to the results CSV and a rerun resumes it (see round_checkpoint.py).
+
+    # Per-stage instrumentation, written next to the results CSV when enabled
+    profiler = RoundProfiler(enabled=profile)
+    shared_dataset = None
+    round_checkpoint = None
+    try:
+        with profiler.stage('read_results_csv'):
+            results_df = load_network_results(results_filename)  # Column names are stripped and normalized
 
-    # Extract basename from results CSV file for plotting
-    results_basename = os.path.splitext(os.path.basename(results_filename))[0]
+        # Extract basename from results CSV file for plotting
+        results_basename = os.path.splitext(os.path.basename(results_filename))[0]
 
-    # Number of clients for fixed distribution
-    num_clients = len(results_df['Client'].unique())
-    min_limit = 0.25  # values: 0, 0.25, 0.5, 0.75, 1
-    selected_clients = abs(min_limit)
+        # Number of clients for fixed distribution
+        num_clients = len(results_df['Client'].unique())
+        min_limit = 0.25  # values: 0, 0.25, 0.5, 0.75, 1
+        selected_clients = abs(min_limit)
 
-    # Validate number of clients
-    if num_clients <= 0:
-        print("Error: Number of clients must be greater than 0.")
-        return
+        # Validate number of clients
+        if num_clients <= 0:
+            print("Error: Number of clients must be greater than 0.")
+            return
 
-    # Distribute data to clients
-    client_data, dataset_sizes = distribute_data(df, num_clients)
+        # Shards, responses and the aggregate of an interrupted run of the same round are reused
+        if checkpoint and shared_memory:
+            print("Checkpoints need shard files; running without one.")
+        elif checkpoint:
+            round_key = {'dataset': file_signature(DATASET_FILENAME), 'results': file_signature(results_filename),
+                         'num_clients': num_clients, 'min_limit': min_limit, 'k': 3, 'genre': genre,
+                         'shard_dir': os.path.abspath(SHARD_DIR)}
+            checkpoint_path = os.path.join(os.path.dirname(results_filename) or '.',
+                                           f'{results_basename}{CHECKPOINT_SUFFIX}')
+            round_checkpoint = RoundCheckpoint(checkpoint_path, round_key)
+            if round_checkpoint.resumed:
+                print(f"Resuming round from {checkpoint_path}: {len(round_checkpoint.distributed)} clients distributed, "
+                      f"{len(round_checkpoint.responses)} answered, {len(round_checkpoint.failures)} failed")
+
+        # Distribute data to clients
+        if shared_memory:
+            with profiler.stage('distribute_shared'):
+                shared_dataset, client_ranges, dataset_sizes = distribute_shared(DATASET_FILENAME, num_clients,
+                                                                                 chunksize)
+        else:
+            with profiler.stage('distribute_csv'):  # CSV read and shard writes are interleaved chunk by chunk
+                client_shards, dataset_sizes = distribute_csv(DATASET_FILENAME, num_clients, chunksize=chunksize,
+                                                              checkpoint=round_checkpoint)
     
-    # Print dataset sizes for each client
-    #print("\nDataset size for each client:")
-    #for client_id in range(1, num_clients + 1):
-     #   print(f"Client ID {client_id}: {dataset_sizes.get(client_id, 0)} rows")
+        # Print dataset sizes for each client
+        #print("\nDataset size for each client:")
+        #for client_id in range(1, num_clients + 1):
+         #   print(f"Client ID {client_id}: {dataset_sizes.get(client_id, 0)} rows")
+
+        #print()
+
+        if async_round:
+            if shared_dataset is not None:
+                client_work = partial(query_shared_view, dataset=shared_dataset, ranges=client_ranges, genre=genre)
+            else:
+                client_work = partial(query_client, cache_dir=cache_dir, cache_bytes=cache_bytes, genre=genre)
+            with profiler.stage('async_round'):
+                run_async_round(results_df, num_clients, results_basename, deadline, straggler_cutoff, seed,
+                                client_work, genre)
+            return
 
-    #print()
+        # Filter clients based on Rx_Packets and Tx_Packets condition
+        with profiler.stage('reliability_filter'):
+            reliable_client_ids = select_reliable_clients(results_df, selected_clients)
 
-    # Filter clients based on Rx_Packets and Tx_Packets condition
-    filtered_clients = results_df[results_df['Rx_Packets'] >= selected_clients * results_df['Tx_Packets']]
-    reliable_client_ids = filtered_clients['Client'].unique()
+        if len(reliable_client_ids) == 0:
+            print("Error: All clients failed to transmit")
+            return
 
-    if len(reliable_client_ids) == 0:
-        print("Error: All clients failed to transmit")
-        return
+        # A declarative query replaces the fixed top songs question
+        if query is not None:
+            with profiler.stage('federated_query'):
+                if shared_dataset is not None:
+                    result = query.merge(query.execute(shared_dataset.client_shard(*client_ranges[int(client_id) - 1]))
+                                         for client_id in reliable_client_ids)
+                else:
+                    result, _ = federated_query(query, reliable_client_ids, num_workers=num_workers)
+            print(f"\nNumber of selected Clients: {len(reliable_client_ids)}")
+            print(result.to_string(index=False))
+            return
 
-    try:
-        # Ensure reliable_client_ids does not exceed num_clients
-        if len(reliable_client_ids) > num_clients:
-            raise ClientCountError(f"Error: Number of selected clients ({len(reliable_client_ids)}) exceeds the total number of clients ({num_clients}).")
-
-        # Initialize counters and lists
-        successful_client_count = 0
-        successful_client_ids = []
-        results_from_clients = []
-
-        # Load data from clients and query
-        for client_id in reliable_client_ids:
-            client_filename = f'client_models/client_data_{client_id}.pkl'
-            if os.path.exists(client_filename):
-                with open(client_filename, 'rb') as f:
-                    client_df = pickle.load(f)
-                top_songs = find_top_songs(client_df)
+        try:
+            # Ensure reliable_client_ids does not exceed num_clients
+            if len(reliable_client_ids) > num_clients:
+                raise ClientCountError(f"Error: Number of selected clients ({len(reliable_client_ids)}) exceeds the total number of clients ({num_clients}).")
+
+            # Initialize counters and lists
+            successful_client_count = 0
+            successful_client_ids = []
+            results_from_clients = []
+            client_responses = []  # Per-client responses for the tree aggregation
+
+            # Load data from clients and query
+            failures = {}
+            if shared_dataset is not None:
+                with profiler.stage('query_shared_clients'):
+                    client_results = query_shared_clients(shared_dataset, client_ranges, reliable_client_ids,
+                                                          num_workers, genre=genre)
+            elif round_checkpoint is not None:
+                with profiler.stage('checkpointed_query_clients'):
+                    client_results, failures = checkpointed_query_clients(
+                        reliable_client_ids, round_checkpoint, num_workers, cache_dir=cache_dir,
+                        cache_bytes=cache_bytes, genre=genre)
+            else:
+                client_results = query_clients(reliable_client_ids, num_workers, cache_dir=cache_dir,
+                                               cache_bytes=cache_bytes, profiler=profiler, genre=genre,
+                                               failures=failures)
+            for client_id, error in failures.items():
+                print(f"Client {client_id} failed: {error}")
+
+            # Responses sent in the wire format must also fit the link's packet budget
+            if wire_format:
+                with profiler.stage('wire_format'):
+                    client_results, report = transmit_responses(client_results, results_df, selected_clients, compress)
+                print(report.to_string(index=False))
+                print(f"Clients whose response arrived whole: {len(client_results)} of {len(report)}")
+
+            for client_id, top_songs in client_results:
+                if top_songs is not None:
+                    results_from_clients.extend(top_songs)
+                    client_responses.append(top_songs)
+                    successful_client_count += 1
+                    successful_client_ids.append(client_id)
+
+            if not results_from_clients:
+                print("No song popularity data available from clients.")
+                return
+
+            # Aggregate results from all clients by averaging popularity, and get the top 3 songs
+            # With fan_out, intermediate aggregators (processes when num_workers > 1) pre-merge the responses
+            # A checkpointed round that already aggregated the same clients reuses that result
+            with profiler.stage('aggregation'):
+                final_top_songs = None
+                if round_checkpoint is not None:
+                    final_top_songs = round_checkpoint.aggregated_result(successful_client_ids)
+                if final_top_songs is None:
+                    if fan_out is None:
+                        final_top_songs = aggregate_top_songs(results_from_clients, 3)
+                    elif num_workers > 1:
+                        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+                            final_top_songs = aggregate_top_songs_tree(client_responses, 3, fan_out, executor)
+                    else:
+                        final_top_songs = aggregate_top_songs_tree(client_responses, 3, fan_out)
+                    if round_checkpoint is not None:
+                        round_checkpoint.record_aggregated(successful_client_ids, final_top_songs)
+
+            # Plot the averaged popularity of top songs
+            with profiler.stage('plot'):
+                plot_song_popularity(final_top_songs, results_basename)
+
+            genre_filter = '' if genre is None else f' {genre}'
+            if exact_k is not None:
+                with profiler.stage('exact_top_k'):
+                    if shared_dataset is not None:
+                        exact_songs, report = exact_top_songs(successful_client_ids, exact_k,
+                                                              dataset=shared_dataset, ranges=client_ranges, genre=genre)
+                    else:
+                        exact_songs, report = exact_top_songs(successful_client_ids, exact_k, genre=genre)
+                print(f"\nExact top {exact_k}{genre_filter} songs by total popularity (TPUT):")
+                for idx, (song, total_popularity) in enumerate(exact_songs, start=1):
+                    print(f"{idx}. {song} with total popularity {total_popularity:.0f}")
+                print(report.to_string(index=False))
+                print(f"Sent {report['bytes_sent'].sum()} bytes instead of {report['full_bytes'].sum()}")
+
+            # Output the final results and performance metrics
+            print(f"\nTotal number of clients: {num_clients}")
+            print(f"Number of selected Clients: {len(reliable_client_ids)}")
+            print(f"\nQuery: What are the current top 3 most popular{genre_filter} songs?")
+
+            print(f"\nThe aggregated top 3 most popular{genre_filter} songs are:")
+            for idx, (song, popularity) in enumerate(final_top_songs, start=1):
+                print(f"{idx}. {song} with averaged popularity {popularity:.2f}")
+            print()
+        except ClientCountError as e:
+            print(e)
+    finally:
+        if shared_dataset is not None:
+            shared_dataset.close()
+        if round_checkpoint is not None:
+            round_checkpoint.close()
+        if profiler.enabled:
+            results_basename = os.path.splitext(os.path.basename(results_filename))[0]
+            json_path, csv_path = profiler.write_report(results_basename, os.path.dirname(results_filename) or '.')
+            print(f"Profile written to {json_path} and {csv_path}")
+
+def run_async_round(results_df, num_clients, results_basename, deadline, straggler_cutoff, seed,
+                    client_work=query_client, genre=None):
+    # genre only labels the output; client_work must already apply it
+    # Every client takes part; its response is delayed and possibly lost according to its ns-3 metrics
+    links = client_links(results_df)
+    round_result = simulate_round(links, client_work, deadline=deadline, straggler_cutoff=straggler_cutoff, seed=seed)
+
+    # Aggregate in client order so the result does not depend on arrival order
+    results_from_clients = []
+    for link in links:
+        if link.client_id in round_result.responses:
+            _, top_songs = round_result.responses[link.client_id]
+            if top_songs is not None:
                 results_from_clients.extend(top_songs)
-                successful_client_count += 1
-                successful_client_ids.append(client_id)
 
-        if not results_from_clients:
-            print("No song popularity data available from clients.")
-            return
+    print(f"\nTotal number of clients: {num_clients}")
+    print(f"Clients that made the deadline: {len(round_result.responses)}")
+    print(f"Clients whose response was lost: {len(round_result.dropped)}")
+    print(f"Clients cut off as stragglers: {len(round_result.late)}")
+    print(f"Round completion time: {round_result.completion_time:.3f} s")
+
+    if not results_from_clients:
+        print("No song popularity data available from clients.")
+        return
 
-        # Aggregate results from all clients by averaging popularity
-        song_popularity = {}
-        song_counts = {}
-        for popularity, song in results_from_clients:
-            if song not in song_popularity:
-                song_popularity[song] = 0
-                song_counts[song] = 0
-            song_popularity[song] += popularity
-            song_counts[song] += 1
-
-        # Calculate average popularity
-        for song in song_popularity:
-            song_popularity[song] /= song_counts[song]
-
-        # Sort songs by their average popularity in descending order
-        sorted_songs = sorted(song_popularity.items(), key=lambda x: -x[1])
-
-        # Get the top 3 songs
-        final_top_songs = sorted_songs[:3]
-
-        # Plot the averaged popularity of top songs
-        plot_song_popularity(final_top_songs, results_basename)
-
-        # Output the final results and performance metrics
-        print(f"\nTotal number of clients: {num_clients}")
-        print(f"Number of selected Clients: {len(reliable_client_ids)}")
-        print(f"\nQuery: What are the current top 3 most popular songs?")
-
-        print("\nThe aggregated top 3 most popular songs are:")
-        for idx, (song, popularity) in enumerate(final_top_songs, start=1):
-            print(f"{idx}. {song} with averaged popularity {popularity:.2f}")
-        print()
-    except ClientCountError as e:
-        print(e)
+    final_top_songs = aggregate_top_songs(results_from_clients, 3)
+    plot_song_popularity(final_top_songs, results_basename)
+
+    genre_filter = '' if genre is None else f' {genre}'
+    print(f"\nQuery: What are the current top 3 most popular{genre_filter} songs?")
+    print(f"\nThe aggregated top 3 most popular{genre_filter} songs are:")
+    for idx, (song, popularity) in enumerate(final_top_songs, start=1):
+        print(f"{idx}. {song} with averaged popularity {popularity:.2f}")
+    print()
+
+def run_sweep(results_filenames, min_limits, num_workers=1, chunksize=DEFAULT_CHUNKSIZE, k=3,
+              output_filename=SWEEP_RESULTS_FILENAME, cache_dir=None, cache_bytes=DEFAULT_CACHE_BYTES, genre=None):
+    # Evaluates every (results file, min_limit) combination. Shards are distributed once per
+    # client count and every client is queried at most once; its top-k is reused by all scenarios.
+    # With genre, every scenario only considers songs of that playlist_genre.
+    scenarios = {filename: load_network_results(filename) for filename in results_filenames}
+    scenarios_by_client_count = {}
+    for filename, results_df in scenarios.items():
+        scenarios_by_client_count.setdefault(len(results_df['Client'].unique()), []).append(filename)
+
+    rows = []
+    for num_clients, filenames in scenarios_by_client_count.items():
+        if num_clients <= 0:
+            print(f"Skipping {', '.join(filenames)}: number of clients must be greater than 0.")
+            continue
+        distribute_csv(DATASET_FILENAME, num_clients, chunksize=chunksize)
+
+        # Query the union of clients selected by any combination, once each
+        selections = {
+            (filename, min_limit): select_reliable_clients(scenarios[filename], min_limit)
+            for filename in filenames for min_limit in min_limits
+        }
+        needed_client_ids = sorted({int(client_id) for client_ids in selections.values() for client_id in client_ids})
+        client_top_songs = dict(query_clients(needed_client_ids, num_workers, k=k, cache_dir=cache_dir,
+                                              cache_bytes=cache_bytes, genre=genre))
+
+        for (filename, min_limit), reliable_client_ids in selections.items():
+            results_from_clients = []
+            for client_id in reliable_client_ids:
+                top_songs = client_top_songs.get(int(client_id))
+                if top_songs is not None:
+                    results_from_clients.extend(top_songs)
+            final_top_songs = aggregate_top_songs(results_from_clients, k) if results_from_clients else []
+            scenario_row = {
+                'scenario': os.path.splitext(os.path.basename(filename))[0],
+                'min_limit': min_limit,
+                'num_clients': num_clients,
+                'num_selected_clients': len(reliable_client_ids),
+            }
+            # Combinations without any data still get a row, with empty rank and song
+            for rank, (song, popularity) in enumerate(final_top_songs or [(None, None)], start=1):
+                rows.append({**scenario_row, 'rank': rank if song is not None else None,
+                             'song': song, 'averaged_popularity': popularity})
+
+    sweep_df = pd.DataFrame(rows, columns=SWEEP_COLUMNS)
+    sweep_df['rank'] = sweep_df['rank'].astype('Int64')
+    sweep_df.to_csv(output_filename, index=False)
+    return sweep_df
+
+def delivered_masks(results_df, client_ids, selected_mask, seeds):
+    # One row per seed: the selected clients whose response survived a draw against their ns-3 packet
+    # loss ratio, as in the async round. A seed of None keeps every selected client.
+    loss_ratio = (results_df.drop_duplicates('Client').set_index('Client')['Packet_Loss_Ratio_(%)'] / 100)
+    loss_ratio = loss_ratio.reindex(client_ids).fillna(1.0).clip(0.0, 1.0).to_numpy()
+    masks = []
+    for seed in seeds:
+        if seed is None:
+            masks.append(selected_mask)
+        else:
+            masks.append(selected_mask & (np.random.default_rng(seed).random(len(client_ids)) >= loss_ratio))
+    return np.array(masks, dtype=bool).reshape(len(seeds), len(client_ids))
+
+def run_evaluation(results_filenames, min_limits, ks=(3,), seeds=(None,), num_workers=1, chunksize=DEFAULT_CHUNKSIZE,
+                   output_filename=EVALUATION_RESULTS_FILENAME, cache_dir=None, cache_bytes=DEFAULT_CACHE_BYTES,
+                   genre=None):
+    # Scores every (results file, min_limit, k, seed) round against the centralized top-k, which is
+    # computed once. Clients are queried once for the largest k and the rounds are aggregated and
+    # scored in batches (see accuracy_evaluation.py). With genre, both sides only consider that playlist_genre.
+    ks = sorted({int(k) for k in ks})
+    max_k = ks[-1]
+    truth_songs = [song for _, song in find_top_songs_streaming(DATASET_FILENAME, k=max_k, chunksize=chunksize,
+                                                                genre=genre)]
+
+    scenarios = {filename: load_network_results(filename) for filename in results_filenames}
+    scenarios_by_client_count = {}
+    for filename, results_df in scenarios.items():
+        scenarios_by_client_count.setdefault(len(results_df['Client'].unique()), []).append(filename)
+
+    tables = []
+    for num_clients, filenames in scenarios_by_client_count.items():
+        if num_clients <= 0:
+            print(f"Skipping {', '.join(filenames)}: number of clients must be greater than 0.")
+            continue
+        distribute_csv(DATASET_FILENAME, num_clients, chunksize=chunksize)
+
+        selections = {
+            (filename, min_limit): select_reliable_clients(scenarios[filename], min_limit)
+            for filename in filenames for min_limit in min_limits
+        }
+        needed_client_ids = sorted({int(client_id) for client_ids in selections.values() for client_id in client_ids})
+        responses = ClientResponses(query_clients(needed_client_ids, num_workers, k=max_k, cache_dir=cache_dir,
+                                                  cache_bytes=cache_bytes, genre=genre))
+        truth_ids = responses.dictionary.encode(truth_songs)
+
+        rows = []
+        masks = []
+        orders = []  # Each round aggregates its clients in the order main and run_sweep would
+        for (filename, min_limit), reliable_client_ids in selections.items():
+            selected_mask = responses.client_mask(reliable_client_ids)
+            client_order = responses.client_order(reliable_client_ids)
+            for seed, mask in zip(seeds, delivered_masks(scenarios[filename], responses.client_ids,
+                                                         selected_mask, seeds)):
+                rows.append({
+                    'scenario': os.path.splitext(os.path.basename(filename))[0],
+                    'min_limit': min_limit,
+                    'seed': seed,
+                    'num_clients': num_clients,
+                    'num_selected_clients': len(reliable_client_ids),
+                    'num_delivered_clients': int((mask & responses.responded).sum()),
+                })
+                masks.append(mask)
+                orders.append(client_order)
+        masks = np.array(masks, dtype=bool).reshape(len(rows), len(responses))
+        orders = np.array(orders, dtype=np.int64).reshape(len(rows), len(responses))
+
+        for k in ks:
+            scores = score_top_k(truth_ids[:k], responses.top_k(masks, k, orders))
+            tables.append(pd.concat([pd.DataFrame(rows).assign(k=k), scores], axis=1))
+
+    evaluation_df = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame()
+    evaluation_df = evaluation_df.reindex(columns=EVALUATION_COLUMNS)
+    evaluation_df['seed'] = evaluation_df['seed'].astype('Int64')
+    evaluation_df = evaluation_df.sort_values(['scenario', 'min_limit', 'k'], kind='stable', ignore_index=True)
+    evaluation_df.to_csv(output_filename, index=False)
+    return evaluation_df
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Federated top songs query over ns-3 filtered clients")
+    parser.add_argument('--workers', type=int, default=1, help="Processes used to query client shards (1 runs serially)")
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE, help="Rows read from the songs CSV at a time")
+    parser.add_argument('--async-round', action='store_true', help="Simulate the round with per-client ns-3 delay and loss instead of the Rx/Tx filter")
+    parser.add_argument('--deadline', type=float, default=None, help="Round deadline in seconds (async round)")
+    parser.add_argument('--straggler-cutoff', type=float, default=1.0, help="Fraction of clients to wait for before aggregating (async round)")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for simulated packet loss (async round)")
+    parser.add_argument('--sweep', nargs='*', metavar='RESULTS_CSV', default=None,
+                        help="Evaluate several ns-3 results files in one run (default: every *_fa_ns3_results.csv)")
+    parser.add_argument('--min-limits', nargs='+', type=float, default=[0, 0.25, 0.5, 0.75, 1],
+                        help="min_limit values evaluated by --sweep and --evaluate")
+    parser.add_argument('--evaluate', nargs='*', metavar='RESULTS_CSV', default=None,
+                        help="Score federated rounds against the centralized top-k (default: every *_fa_ns3_results.csv)")
+    parser.add_argument('--ks', nargs='+', type=int, default=[3], help="Values of k evaluated by --evaluate")
+    parser.add_argument('--seeds', nargs='+', type=int, default=None,
+                        help="Also drop responses by each client's ns-3 packet loss, once per seed (--evaluate)")
+    parser.add_argument('--cache-dir', default=None,
+                        help="Directory of the persistent per-shard query cache (disabled when omitted)")
+    parser.add_argument('--cache-mb', type=float, default=DEFAULT_CACHE_BYTES / (1024 * 1024),
+                        help="Size limit of the query cache in MB; least recently used entries are evicted")
+    parser.add_argument('--profile', action='store_true',
+                        help="Record per-stage and per-client time, I/O and memory next to the results CSV")
+    parser.add_argument('--fan-out', type=int, default=None,
+                        help="Aggregate client responses in a tree with this many children per aggregator")
+    parser.add_argument('--exact-k', type=int, default=None,
+                        help="Also compute the exact top-k songs by total popularity with the TPUT protocol")
+    parser.add_argument('--wire-format', action='store_true',
+                        help="Send client responses in the compact binary format and filter clients by its packet count")
+    parser.add_argument('--compress', action='store_true', help="zlib-compress wire format payloads")
+    parser.add_argument('--shared-memory', action='store_true',
+                        help="Keep the catalogue in one shared memory block with clients as row ranges instead of shard files")
+    parser.add_argument('--genre', default=None, help="Only consider songs of this playlist_genre")
+    parser.add_argument('--query', type=json.loads, default=None,
+                        help='Query arguments as JSON, e.g. \'{"group_by": "playlist_genre", '
+                             '"aggregates": [["mean", "track_popularity"]]}\'')
+    parser.add_argument('--results', default='0.5_fa_ns3_results.csv',
+                        help="ns-3 results CSV of the round, e.g. one written by network_model.py")
+    parser.add_argument('--checkpoint', action='store_true',
+                        help="Log the round's progress next to the results CSV and resume an interrupted run from it")
+    args = parser.parse_args()
+    if args.genre is not None and args.query is not None:
+        parser.error("--genre does not apply to --query; filter on playlist_genre in its where clause")
+    if not 0 < args.straggler_cutoff <= 1:
+        parser.error("--straggler-cutoff must be in (0, 1]")
+    cache_bytes = int(args.cache_mb * 1024 * 1024)
+    if args.sweep is not None:
+        results_filenames = args.sweep or sorted(glob.glob('*_fa_ns3_results.csv'))
+        sweep_df = run_sweep(results_filenames, args.min_limits, num_workers=args.workers, chunksize=args.chunksize,
+                             cache_dir=args.cache_dir, cache_bytes=cache_bytes, genre=args.genre)
+        print(sweep_df.to_string(index=False))
+        raise SystemExit
+    if args.evaluate is not None:
+        results_filenames = args.evaluate or sorted(glob.glob('*_fa_ns3_results.csv'))
+        evaluation_df = run_evaluation(results_filenames, args.min_limits, ks=args.ks,
+                                       seeds=args.seeds if args.seeds is not None else [None],
+                                       num_workers=args.workers, chunksize=args.chunksize,
+                                       cache_dir=args.cache_dir, cache_bytes=cache_bytes, genre=args.genre)
+        print(evaluation_df.to_string(index=False))
+        raise SystemExit
+    main(num_workers=args.workers, chunksize=args.chunksize, async_round=args.async_round, deadline=args.deadline,
+         straggler_cutoff=args.straggler_cutoff, seed=args.seed,
+         cache_dir=args.cache_dir, cache_bytes=cache_bytes, profile=args.profile,
+         fan_out=args.fan_out, exact_k=args.exact_k, wire_format=args.wire_format, compress=args.compress,
+         shared_memory=args.shared_memory, genre=args.genre,
+         query=Query(**args.query) if args.query is not None else None, results_filename=args.results,
+         checkpoint=args.checkpoint)
 
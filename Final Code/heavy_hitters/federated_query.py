@@ -0,0 +1,240 @@
+import operator
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from client_shards import SHARD_DIR, STRING_KIND, ClientShard, open_client_shard
+
+# Declarative queries over the federated shards.
+#
+# A Query is either a row query (top-k rows by a column, with a projection)
+# or an aggregate query (count/sum/mean/min/max per group). Every client runs
+# the same plan on its own shard:
+#
+#   1. filters on numeric columns are evaluated first, on the memory-mapped
+#      columns, and string filters only decode the rows that are left
+#   2. only the columns the query needs are read, and only for matching rows
+#   3. a row query sends back its local top-k rows; an aggregate query sends
+#      one row of partial aggregates (count, sum, min, max) per group
+#
+# The server merges the partials, so the result is the same as running the
+# query on the concatenated shards.
+#
+#   Query(where=[('playlist_genre', '==', 'rock')], order_by='track_popularity', k=3,
+#         select=['track_name', 'track_artist', 'track_popularity'])
+#   Query(group_by=['playlist_genre'], aggregates=[('count', None), ('mean', 'track_popularity')],
+#         order_by='mean_track_popularity', k=5)
+
+FILTER_OPS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'in': lambda values, options: np.isin(values, list(options)),
+}
+AGGREGATES = ('count', 'sum', 'mean', 'min', 'max')
+
+
+class Query:
+    def __init__(self, select=None, where=(), group_by=(), aggregates=(), order_by=None, k=None, descending=True):
+        self.select = list(select) if select is not None else None
+        self.where = [tuple(condition) for condition in where]
+        self.group_by = [group_by] if isinstance(group_by, str) else list(group_by)
+        self.aggregates = [tuple(aggregate) for aggregate in aggregates]
+        self.order_by = order_by
+        self.k = k
+        self.descending = descending
+
+        for column, op, _ in self.where:
+            if op not in FILTER_OPS:
+                raise ValueError(f"Unknown filter operator '{op}' on column '{column}'")
+        for function, column in self.aggregates:
+            if function not in AGGREGATES:
+                raise ValueError(f"Unknown aggregate '{function}'")
+            if column is None and function != 'count':
+                raise ValueError(f"Aggregate '{function}' needs a column")
+        if self.group_by and not self.aggregates:
+            raise ValueError("group_by needs at least one aggregate")
+        if self.is_aggregate() and order_by is not None and order_by not in self.output_columns():
+            raise ValueError(f"order_by '{order_by}' is not one of {self.output_columns()}")
+
+    def is_aggregate(self):
+        return bool(self.aggregates)
+
+    def output_columns(self):
+        if not self.is_aggregate():
+            return self.select
+        return self.group_by + [function if column is None else f'{function}_{column}'
+                                for function, column in self.aggregates]
+
+    def partial_columns(self):
+        # Columns of a client's row query partial: the projection plus the sort key the server still needs
+        if self.select is None or self.order_by is None or self.order_by in self.select:
+            return self.select
+        return self.select + [self.order_by]
+
+    def aggregated_columns(self):
+        return list(dict.fromkeys(column for _, column in self.aggregates if column is not None))
+
+    def columns(self, available=()):
+        # Columns a client must read: the projection pushed down to the shard. A row query
+        # without select returns whole rows, so it reads all of the available columns
+        if self.is_aggregate():
+            needed = self.group_by + self.aggregated_columns()
+        elif self.select is None:
+            needed = list(available)
+        else:
+            needed = list(self.select or []) + ([self.order_by] if self.order_by is not None else [])
+        return list(dict.fromkeys(needed + [column for column, _, _ in self.where]))
+
+    def _sort_rows(self, frame):
+        if self.order_by is not None:
+            frame = frame.sort_values(self.order_by, ascending=not self.descending, kind='stable',
+                                      na_position='last')
+        return frame if self.k is None else frame.head(self.k)
+
+    def execute(self, shard):
+        # Client side: the partial result of this query on one shard
+        rows = _filter_rows(shard, self.where)
+        frame = _project(shard, self.columns(shard.columns), rows)
+        if not self.is_aggregate():
+            frame = self._sort_rows(frame)
+            return frame[self.partial_columns()] if self.select is not None else frame
+
+        grouped = frame.assign(_rows=1).groupby(self.group_by, sort=False, dropna=False) if self.group_by \
+            else frame.assign(_rows=1).groupby(np.zeros(len(frame), dtype=np.int8), sort=False)
+        aggregations = {'count': ('_rows', 'sum')}
+        for column in self.aggregated_columns():
+            aggregations[f'count_{column}'] = (column, 'count')
+            aggregations[f'sum_{column}'] = (column, 'sum')
+            aggregations[f'min_{column}'] = (column, 'min')
+            aggregations[f'max_{column}'] = (column, 'max')
+        partial_result = grouped.agg(**aggregations)
+        return partial_result.reset_index() if self.group_by else partial_result.reset_index(drop=True)
+
+    def merge(self, partials):
+        # Server side: combines the clients' partial results into the final answer
+        partials = [partial_result for partial_result in partials if partial_result is not None]
+        if not partials:
+            return pd.DataFrame(columns=self.output_columns() or [])
+        combined = pd.concat(partials, ignore_index=True)
+        if not self.is_aggregate():
+            result = self._sort_rows(combined).reset_index(drop=True)
+            return result[self.select] if self.select is not None else result
+
+        merge_functions = {'count': 'sum'}
+        for column in self.aggregated_columns():
+            merge_functions.update({f'count_{column}': 'sum', f'sum_{column}': 'sum',
+                                    f'min_{column}': 'min', f'max_{column}': 'max'})
+        if self.group_by:
+            merged = combined.groupby(self.group_by, sort=False, dropna=False).agg(merge_functions).reset_index()
+        else:
+            merged = combined.agg(merge_functions).to_frame().T
+
+        result = merged[self.group_by].copy()
+        for function, column in self.aggregates:
+            if column is None:
+                result['count'] = merged['count'].astype(np.int64)
+            elif function == 'count':
+                result[f'count_{column}'] = merged[f'count_{column}'].astype(np.int64)
+            elif function == 'mean':
+                counts = merged[f'count_{column}'].astype(np.float64)
+                result[f'mean_{column}'] = merged[f'sum_{column}'].astype(np.float64) / counts.where(counts > 0)
+            else:
+                result[f'{function}_{column}'] = merged[f'{function}_{column}']
+        return self._sort_rows(result).reset_index(drop=True)
+
+
+def _filter_rows(shard, where):
+    # Row numbers matching every condition; numeric conditions run before string ones
+    rows = np.arange(len(shard))
+    numeric = [condition for condition in where if shard.columns[condition[0]] != STRING_KIND]
+    strings = [condition for condition in where if shard.columns[condition[0]] == STRING_KIND]
+    for column, op, value in numeric:
+        values, valid = shard.numeric(column)
+        values = np.asarray(values[rows])
+        matches = FILTER_OPS[op](values, value)
+        rows = rows[matches & (np.asarray(valid[rows]) if valid is not None else ~np.isnan(values))]
+    for column, op, value in strings:
+        values = np.array(shard.strings(column, rows), dtype=object)
+        present = np.array([isinstance(item, str) for item in values], dtype=bool)
+        matches = np.zeros(len(rows), dtype=bool)
+        matches[present] = FILTER_OPS[op](values[present], value)
+        rows = rows[matches]
+    return rows
+
+
+def _project(shard, columns, rows):
+    data = {}
+    for name in columns:
+        if shard.columns[name] == STRING_KIND:
+            data[name] = pd.Series(shard.strings(name, rows), dtype=object)
+        else:
+            values, valid = shard.numeric(name)
+            if valid is None:
+                data[name] = pd.Series(np.asarray(values[rows]))
+            else:
+                data[name] = pd.arrays.IntegerArray(np.asarray(values[rows]), ~np.asarray(valid[rows], dtype=bool))
+    return pd.DataFrame(data, index=pd.RangeIndex(len(rows)))
+
+
+def query_shard(client_id, query, shard_dir=SHARD_DIR):
+    # Worker side: (client_id, partial result or None when the client has no shard)
+    shard = open_client_shard(int(client_id), shard_dir)
+    return client_id, None if shard is None else query.execute(shard)
+
+
+def federated_query(query, client_ids, shard_dir=SHARD_DIR, num_workers=1):
+    # Runs the query on every client and merges the partials; returns (result, {client_id: partial rows sent})
+    client_ids = [int(client_id) for client_id in client_ids]
+    worker = partial(query_shard, query=query, shard_dir=shard_dir)
+    if num_workers <= 1 or len(client_ids) <= 1:
+        partials = [worker(client_id) for client_id in client_ids]
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            partials = list(executor.map(worker, client_ids))
+    rows_sent = {client_id: 0 if partial_result is None else len(partial_result)
+                 for client_id, partial_result in partials}
+    return query.merge(partial_result for _, partial_result in partials), rows_sent
+
+
+class QueryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.songs = pd.DataFrame({
+            'track_name': ['a', 'b', 'c', 'd', 'e'],
+            'track_popularity': [10, 90, 50, 70, 30],
+            'playlist_genre': ['pop', 'rock', 'pop', 'pop', 'rock'],
+        })
+        self.shards = [ClientShard.from_frame(self.songs.iloc[:3].reset_index(drop=True)),
+                       ClientShard.from_frame(self.songs.iloc[3:].reset_index(drop=True))]
+
+    def run_query(self, query):
+        return query.merge(query.execute(shard) for shard in self.shards)
+
+    def test_rows_without_select_keep_every_column(self):
+        result = self.run_query(Query(order_by='track_popularity', k=3))
+        self.assertEqual(list(result.columns), list(self.songs.columns))
+        self.assertEqual(result['track_name'].tolist(), ['b', 'd', 'c'])
+        self.assertEqual(result['playlist_genre'].tolist(), ['rock', 'pop', 'pop'])
+
+    def test_order_by_outside_select(self):
+        result = self.run_query(Query(select=['track_name'], order_by='track_popularity', k=2))
+        self.assertEqual(list(result.columns), ['track_name'])
+        self.assertEqual(result['track_name'].tolist(), ['b', 'd'])
+
+    def test_aggregates_match_the_whole_catalogue(self):
+        query = Query(where=[('track_popularity', '>=', 30)], group_by='playlist_genre',
+                      aggregates=[('count', None), ('mean', 'track_popularity'), ('max', 'track_popularity')],
+                      order_by='mean_track_popularity')
+        result = self.run_query(query).set_index('playlist_genre')
+        expected = self.songs[self.songs['track_popularity'] >= 30].groupby('playlist_genre')['track_popularity']
+        self.assertEqual(result['count'].to_dict(), expected.count().to_dict())
+        self.assertEqual(result['mean_track_popularity'].to_dict(), expected.mean().to_dict())
+        self.assertEqual(result['max_track_popularity'].to_dict(), expected.max().to_dict())
+        self.assertEqual(list(result.index), ['rock', 'pop'])
@@ -0,0 +1,144 @@
+import unittest
+
+import numpy as np
+
+# Integer-encoded aggregation of client results.
+#
+# Keys (song labels, items) are encoded once into dense integer IDs by an
+# ItemDictionary shared by every client of a round. ItemAggregator collects
+# batches of (id, value) arrays and folds them with np.bincount when a result
+# is requested, so no per-item Python work happens during aggregation. Labels
+# are decoded only for the final top-k (or the heavy hitters).
+#
+# Code 1/FA1.py imports both classes from here; its counts are integers, so it
+# aggregates with dtype=np.int64.
+
+
+class ItemDictionary:
+    # IDs are assigned in order of first appearance
+
+    def __init__(self):
+        self.ids = {}
+        self.keys = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _encode_one(self, key):
+        item_id = self.ids.get(key)
+        if item_id is None:
+            item_id = self.ids[key] = len(self.keys)
+            self.keys.append(key)
+        return item_id
+
+    def encode(self, keys):
+        return np.fromiter((self._encode_one(key) for key in keys), dtype=np.int64)
+
+    def decode(self, ids):
+        return [self.keys[item_id] for item_id in ids]
+
+    def truncate(self, size):
+        # Forgets the keys added after the first size ones
+        for key in self.keys[size:]:
+            del self.ids[key]
+        del self.keys[size:]
+
+
+class ItemAggregator:
+    # Sum, count and mean of values per item ID; sums have the given dtype
+
+    def __init__(self, dictionary=None, dtype=np.float64):
+        self.dictionary = dictionary if dictionary is not None else ItemDictionary()
+        self._sums = np.zeros(0, dtype=dtype)
+        self._counts = np.zeros(0, dtype=np.int64)
+        self._pending_ids = []
+        self._pending_values = []
+        self._pending_counts = []
+
+    def add(self, ids, values, counts=None):
+        # With counts, each value is a pre-merged sum over that many observations
+        ids = np.asarray(ids, dtype=np.int64)
+        self._pending_ids.append(ids)
+        self._pending_values.append(np.asarray(values, dtype=self._sums.dtype))
+        self._pending_counts.append(np.ones(len(ids), dtype=np.int64) if counts is None
+                                    else np.asarray(counts, dtype=np.int64))
+
+    def add_items(self, keys, values):
+        self.add(self.dictionary.encode(keys), values)
+
+    def _flush(self):
+        size = len(self.dictionary)
+        if len(self._sums) < size:
+            self._sums = np.concatenate([self._sums, np.zeros(size - len(self._sums), dtype=self._sums.dtype)])
+            self._counts = np.concatenate([self._counts, np.zeros(size - len(self._counts), dtype=np.int64)])
+        if self._pending_ids:
+            ids = np.concatenate(self._pending_ids)
+            values = np.concatenate(self._pending_values)
+            counts = np.concatenate(self._pending_counts)
+            if self._sums.dtype.kind == 'f':
+                self._sums += np.bincount(ids, weights=values, minlength=size)
+            else:
+                np.add.at(self._sums, ids, values)  # bincount weights would turn integer sums into floats
+            np.add.at(self._counts, ids, counts)
+            self._pending_ids = []
+            self._pending_values = []
+            self._pending_counts = []
+
+    def sums(self):
+        self._flush()
+        return self._sums
+
+    def counts(self):
+        self._flush()
+        return self._counts
+
+    def means(self):
+        self._flush()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self._sums / self._counts
+
+    def top_k(self, k, statistic='mean'):
+        # Returns [(key, value)] for the k largest values; ties keep the first-seen item
+        values = {'sum': self.sums, 'count': self.counts, 'mean': self.means}[statistic]()
+        if k <= 0:
+            return []
+        seen = np.flatnonzero(self._counts > 0)
+        candidates = seen
+        if len(seen) > k:
+            kth_value = np.partition(values[seen], len(seen) - k)[len(seen) - k]
+            candidates = seen[values[seen] >= kth_value]
+        top_ids = candidates[np.argsort(-values[candidates], kind='stable')[:k]]
+        return list(zip(self.dictionary.decode(top_ids), values[top_ids].tolist()))
+
+    def heavy_hitters(self, threshold, statistic='sum'):
+        # Returns {key: value} for every seen item whose value reaches threshold, in ID order
+        values = {'sum': self.sums, 'count': self.counts, 'mean': self.means}[statistic]()
+        selected = np.flatnonzero((self._counts > 0) & (values >= threshold))
+        return dict(zip(self.dictionary.decode(selected), values[selected].tolist()))
+
+
+class ItemAggregatorTest(unittest.TestCase):
+
+    def test_statistics_and_first_seen_ties(self):
+        aggregator = ItemAggregator()
+        aggregator.add_items(['b', 'a', 'c'], [80, 90, 90])
+        aggregator.add_items(['a', 'd'], [70, 90])
+        self.assertEqual(aggregator.top_k(3), [('c', 90.0), ('d', 90.0), ('b', 80.0)])
+        self.assertEqual(aggregator.top_k(2, 'sum'), [('a', 160.0), ('c', 90.0)])
+        self.assertEqual(aggregator.heavy_hitters(2, 'count'), {'a': 2})
+
+    def test_integer_sums_with_premerged_counts(self):
+        dictionary = ItemDictionary()
+        aggregator = ItemAggregator(dictionary, dtype=np.int64)
+        aggregator.add(dictionary.encode(['x', 'y']), [3, 4])
+        aggregator.add(dictionary.encode(['x']), [10], counts=[4])
+        self.assertEqual(aggregator.sums().dtype, np.int64)
+        self.assertEqual(aggregator.heavy_hitters(5), {'x': 13})
+        self.assertEqual(aggregator.heavy_hitters(0, 'mean'), {'x': 13 / 5, 'y': 4.0})
+
+    def test_dictionary_truncate(self):
+        dictionary = ItemDictionary()
+        dictionary.encode(['a', 'b', 'c'])
+        dictionary.truncate(1)
+        self.assertEqual(dictionary.encode(['c', 'a']).tolist(), [1, 0])
+        self.assertEqual(dictionary.decode([0, 1]), ['a', 'c'])
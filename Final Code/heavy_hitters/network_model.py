@@ -0,0 +1,200 @@
+import argparse
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from round_simulator import load_network_results
+
+# NumPy surrogate of ns3_rede_wifi_code.cc, to simulate client reliability for
+# many more clients than a packet-level ns-3 run can handle.
+#
+# Each client gets a random distance to the AP (up to 50 m, as in the .cc
+# file) and the log-distance path loss of its channel. A client either
+# connects or, like the stations the ns-3 runs leave stuck at a few packets,
+# does not. The other metrics are drawn from the empirical distributions of the
+# existing *_fa_ns3_results.csv files:
+#   - the packet loss of a connected client is the quantile of the observed
+#     losses at its path loss, scaled from PL(1 m) to PL(50 m) of the .cc
+#     channel, so the loss grows with the log of the distance and clients
+#     beyond 50 m get the worst observed loss
+#   - Tx_Packets, delays and the disconnected Rx_Packets are resampled
+#   - throughput follows the .cc formula
+# Clients whose received power is below the receiver sensitivity never connect.
+
+RESULTS_HEADER = 'Client, Tx_Packets,Rx_Packets,Throughput_(Mbps),Delay_(s),Packet_Loss_Ratio_(%)'
+
+# Parameters of ns3_rede_wifi_code.cc
+TX_POWER_DBM = 50.0
+LOSS_EXPONENT = 4.0
+REFERENCE_LOSS_DB = 40.0
+REFERENCE_DISTANCE_M = 1.0
+MAX_DISTANCE_M = 50.0
+PACKET_SIZE = 1024
+MAX_BYTES = 1024 * 1024
+SIMULATION_TIME_S = 10.0
+
+# UDP + IPv4 headers counted in the flow monitor's rxBytes
+HEADER_BYTES = 28
+
+# YansWifiPhy default RxSensitivity
+RX_SENSITIVITY_DBM = -101.0
+
+# Rx_Packets at or below this count mark a client that never got its flow through
+DISCONNECTED_RX_PACKETS = 3
+
+
+def path_loss_db(distance):
+    # ns3::LogDistancePropagationLossModel
+    distance = np.maximum(np.asarray(distance, dtype=np.float64), REFERENCE_DISTANCE_M)
+    return REFERENCE_LOSS_DB + 10 * LOSS_EXPONENT * np.log10(distance / REFERENCE_DISTANCE_M)
+
+
+def throughput_mbps(rx_packets):
+    return rx_packets * (PACKET_SIZE + HEADER_BYTES) * 8.0 / (SIMULATION_TIME_S - 1) / 1024 / 1024
+
+
+class NetworkModel:
+    def __init__(self, connect_probability, connected_loss, connected_delay, disconnected_rx,
+                 disconnected_delay, tx_packets, max_distance=MAX_DISTANCE_M):
+        self.connect_probability = connect_probability
+        self.connected_loss = np.sort(np.asarray(connected_loss, dtype=np.float64))
+        self.connected_delay = np.asarray(connected_delay, dtype=np.float64)
+        self.disconnected_rx = np.asarray(disconnected_rx, dtype=np.int64)
+        self.disconnected_delay = np.asarray(disconnected_delay, dtype=np.float64)
+        self.tx_packets = np.asarray(tx_packets, dtype=np.int64)
+        self.max_distance = max_distance
+
+    @classmethod
+    def calibrate(cls, filenames, max_distance=MAX_DISTANCE_M):
+        results_df = pd.concat([load_network_results(filename) for filename in filenames], ignore_index=True)
+        connected = results_df['Rx_Packets'] > DISCONNECTED_RX_PACKETS
+        if not connected.any():
+            raise ValueError("The results files have no connected client to calibrate from")
+        finite_delay = np.isfinite(results_df['Delay_(s)'])
+        disconnected_delay = results_df.loc[~connected & finite_delay, 'Delay_(s)']
+        return cls(
+            connect_probability=float(connected.mean()),
+            connected_loss=1 - results_df.loc[connected, 'Rx_Packets'] / results_df.loc[connected, 'Tx_Packets'],
+            connected_delay=results_df.loc[connected & finite_delay, 'Delay_(s)'],
+            disconnected_rx=results_df.loc[~connected, 'Rx_Packets'] if (~connected).any() else [0],
+            disconnected_delay=disconnected_delay if len(disconnected_delay) else [np.inf],
+            tx_packets=results_df['Tx_Packets'],
+            max_distance=max_distance,
+        )
+
+    def sample(self, num_clients, seed=0, connect_probability=None):
+        # One row per client, in the column layout of load_network_results
+        rng = np.random.default_rng(seed)
+        if connect_probability is None:
+            connect_probability = self.connect_probability
+
+        distance = self.max_distance * rng.random(num_clients)
+        received_power = TX_POWER_DBM - path_loss_db(distance)
+        connected = (rng.random(num_clients) < connect_probability) & (received_power >= RX_SENSITIVITY_DBM)
+
+        # Quantile level from the path loss, between the reference distance and the calibration range
+        lowest, highest = path_loss_db(REFERENCE_DISTANCE_M), path_loss_db(MAX_DISTANCE_M)
+        rank = np.clip((path_loss_db(distance) - lowest) / (highest - lowest), 0.0, 1.0)
+        loss = np.quantile(self.connected_loss, rank)
+
+        # The OnOff application stops after MaxBytes
+        tx_packets = np.minimum(rng.choice(self.tx_packets, num_clients), MAX_BYTES // PACKET_SIZE)
+        rx_packets = np.where(connected, np.rint(tx_packets * (1 - loss)).astype(np.int64),
+                              np.minimum(rng.choice(self.disconnected_rx, num_clients), tx_packets))
+        delay = np.where(connected, rng.choice(self.connected_delay, num_clients),
+                         rng.choice(self.disconnected_delay, num_clients))
+        delay = np.where(rx_packets > 0, delay, np.inf)
+        loss_ratio = np.where(tx_packets > 0, (tx_packets - rx_packets) * 100.0 / np.maximum(tx_packets, 1), np.inf)
+
+        return pd.DataFrame({
+            'Client': np.arange(1, num_clients + 1),
+            'Tx_Packets': tx_packets,
+            'Rx_Packets': rx_packets,
+            'Throughput_(Mbps)': throughput_mbps(rx_packets),
+            'Delay_(s)': delay,
+            'Packet_Loss_Ratio_(%)': loss_ratio,
+        })
+
+
+def write_network_results(results_df, filename):
+    # Same header and number format as the CSV written by ns3_rede_wifi_code.cc
+    with open(filename, 'w') as f:
+        f.write(RESULTS_HEADER + '\n')
+        for client, tx, rx, throughput, delay, loss in zip(
+                results_df['Client'], results_df['Tx_Packets'], results_df['Rx_Packets'],
+                results_df['Throughput_(Mbps)'], results_df['Delay_(s)'], results_df['Packet_Loss_Ratio_(%)']):
+            f.write(f'{client},{tx},{rx},{throughput:.6f},{delay:.6f},{loss:.6f}\n')
+
+
+class NetworkModelTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        rng = np.random.default_rng(0)
+        tx = rng.integers(500, 1024, 40)
+        rx = np.where(np.arange(40) % 4 == 0, rng.integers(0, 3, 40), np.rint(tx * rng.uniform(0.5, 1.0, 40)))
+        self.filename = os.path.join(directory, '0.5_fa_ns3_results.csv')
+        write_network_results(pd.DataFrame({
+            'Client': np.arange(1, 41), 'Tx_Packets': tx, 'Rx_Packets': rx.astype(np.int64),
+            'Throughput_(Mbps)': throughput_mbps(rx),
+            'Delay_(s)': np.where(rx > 0, rng.uniform(0.01, 0.2, 40), np.inf),
+            'Packet_Loss_Ratio_(%)': (tx - rx) * 100.0 / tx,
+        }), self.filename)
+
+    def test_sample_follows_the_calibration(self):
+        model = NetworkModel.calibrate([self.filename])
+        self.assertEqual(model.connect_probability, 0.75)
+        results_df = model.sample(5000, seed=1)
+        self.assertTrue(results_df.equals(model.sample(5000, seed=1)))
+        self.assertTrue((results_df['Rx_Packets'] <= results_df['Tx_Packets']).all())
+        connected = results_df['Rx_Packets'] > DISCONNECTED_RX_PACKETS
+        self.assertAlmostEqual(connected.mean(), 0.75, delta=0.03)
+        loss = 1 - results_df['Rx_Packets'][connected] / results_df['Tx_Packets'][connected]
+        self.assertLessEqual(loss.max(), model.connected_loss.max() + 0.01)
+
+        # The written file reads back like an ns-3 results CSV
+        write_network_results(results_df, self.filename)
+        written = load_network_results(self.filename)
+        self.assertEqual(list(written.columns), list(results_df.columns))
+        self.assertTrue((written['Rx_Packets'] == results_df['Rx_Packets']).all())
+
+    def test_path_loss_shapes_the_loss(self):
+        model = NetworkModel.calibrate([self.filename])
+        near = NetworkModel.calibrate([self.filename], max_distance=5.0).sample(5000, seed=1)
+        far = model.sample(5000, seed=1)
+        mean_loss = [(1 - sample['Rx_Packets'] / sample['Tx_Packets'])[sample['Rx_Packets'] > DISCONNECTED_RX_PACKETS]
+                     .mean() for sample in (near, far)]
+        self.assertLess(mean_loss[0], mean_loss[1])
+
+        # Past the receiver sensitivity no client connects
+        self.assertLess(TX_POWER_DBM - path_loss_db(1000.0), RX_SENSITIVITY_DBM)
+        beyond = NetworkModel.calibrate([self.filename], max_distance=100_000.0).sample(5000, seed=1)
+        self.assertLess((beyond['Rx_Packets'] > DISCONNECTED_RX_PACKETS).mean(), 0.05)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate ns-3-like client network results without ns-3")
+    parser.add_argument('--clients', type=int, default=10_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--connect-probability', type=float, default=None,
+                        help="Fraction of clients that connect (default: calibrated from the results files)")
+    parser.add_argument('--max-distance', type=float, default=MAX_DISTANCE_M, help="Largest STA-AP distance in meters")
+    parser.add_argument('--calibrate-from', nargs='+', default=None,
+                        help="ns-3 results files to calibrate from (default: every *_fa_ns3_results.csv)")
+    parser.add_argument('--output', default=None, help="Output CSV (default: surrogate_<clients>_fa_ns3_results.csv)")
+    args = parser.parse_args()
+
+    # Earlier surrogate outputs match the same pattern but are not ns-3 measurements
+    calibration_files = args.calibrate_from or sorted(filename for filename in glob.glob('*_fa_ns3_results.csv')
+                                                      if not filename.startswith('surrogate_'))
+    model = NetworkModel.calibrate(calibration_files, args.max_distance)
+    results_df = model.sample(args.clients, seed=args.seed, connect_probability=args.connect_probability)
+    output = args.output or f'surrogate_{args.clients}_fa_ns3_results.csv'
+    write_network_results(results_df, output)
+    print(f"Wrote {len(results_df)} clients to {output}")
@@ -0,0 +1,161 @@
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+from client_shards import client_shard_path, shard_content_hash, write_client_shard
+
+# Persistent cache of per-client query results.
+#
+# Entries are keyed by the shard content hash, the query name and k, so a
+# rewritten shard with different rows never hits an old entry, while an
+# unchanged shard is answered without being opened. Each entry is one small
+# pickle file; a hit refreshes its mtime and the least recently used entries
+# are evicted once the cache grows past max_bytes.
+#
+# The cache size is walked from the directory once per QueryCache and then
+# tracked by put, so the directory is only listed again when the tracked size
+# passes max_bytes. open_query_cache keeps one QueryCache per directory in each
+# process, so a round does not rescan the directory for every client. Entries
+# written by other processes are only counted at the next walk, so with several
+# writers the directory can briefly exceed max_bytes. Eviction frees down to
+# EVICT_TO of max_bytes, so a full cache walks once per many puts, not per put.
+
+QUERY_CACHE_DIR = 'query_cache'
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+EVICT_TO = 0.9
+
+
+class QueryCache:
+    def __init__(self, cache_dir=QUERY_CACHE_DIR, max_bytes=DEFAULT_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._total_bytes = None  # Size of all entries, walked at the first put and then tracked
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_path(self, content_hash, query, k):
+        key = hashlib.sha256(f'{content_hash}:{query}:{k}'.encode()).hexdigest()
+        return os.path.join(self.cache_dir, f'{key}.pkl')
+
+    def get(self, content_hash, query, k):
+        # Returns None on a miss
+        path = self._entry_path(content_hash, query, k)
+        try:
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+            os.utime(path)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            # Entries can disappear under a concurrent eviction; treat them as misses
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def put(self, content_hash, query, k, result):
+        # Written to a temporary file and renamed, so readers never see a partial entry
+        path = self._entry_path(content_hash, query, k)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(result, f)
+            size = f.tell()
+        try:
+            replaced = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(tmp_path, path)
+        if self._total_bytes is None:
+            self._total_bytes = self._entries()[1]
+        else:
+            self._total_bytes += size - replaced
+        if self._total_bytes > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        # ([(mtime, size, path)], total bytes) of the entries on disk
+        entries = []
+        total_bytes = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith('.pkl'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_bytes += stat.st_size
+        return entries, total_bytes
+
+    def evict(self):
+        # Removes the least recently used entries once the cache is past max_bytes and
+        # resets the tracked size
+        entries, total_bytes = self._entries()
+        if total_bytes <= self.max_bytes:
+            self._total_bytes = total_bytes
+            return
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes * EVICT_TO:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+        self._total_bytes = total_bytes
+
+
+# QueryCache of each cache directory opened by this process
+_open_caches = {}
+
+
+def open_query_cache(cache_dir=QUERY_CACHE_DIR, max_bytes=DEFAULT_CACHE_BYTES):
+    # The process-wide QueryCache of cache_dir, so its tracked size is reused across clients
+    cache = _open_caches.get((cache_dir, max_bytes))
+    if cache is None:
+        cache = _open_caches[(cache_dir, max_bytes)] = QueryCache(cache_dir, max_bytes)
+    return cache
+
+
+class QueryCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+
+    def test_rewritten_shard_misses(self):
+        shard_dir = os.path.join(self.cache_dir, 'shards')
+        songs = pd.DataFrame({'track_name': ['a', 'b'], 'track_popularity': [10, 90]})
+        write_client_shard(songs, client_shard_path(1, shard_dir))
+        cache = QueryCache(os.path.join(self.cache_dir, 'entries'))
+        old_hash = shard_content_hash(1, shard_dir)
+        cache.put(old_hash, 'top_songs', 3, [(90, 'b')])
+
+        # The same rows written again keep their entry; different rows do not see it
+        write_client_shard(songs, client_shard_path(1, shard_dir))
+        self.assertEqual(cache.get(shard_content_hash(1, shard_dir), 'top_songs', 3), [(90, 'b')])
+        write_client_shard(songs.assign(track_popularity=[95, 90]), client_shard_path(1, shard_dir))
+        self.assertNotEqual(shard_content_hash(1, shard_dir), old_hash)
+        self.assertIsNone(cache.get(shard_content_hash(1, shard_dir), 'top_songs', 3))
+        self.assertIsNone(cache.get(old_hash, 'top_songs', 5))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_evicts_least_recently_used(self):
+        cache = QueryCache(self.cache_dir, max_bytes=2000)
+        for i in range(100):
+            cache.put(f'hash{i}', 'top_songs', 3, [(i, 'x' * 40)])
+            if i >= 1:
+                self.assertIsNotNone(cache.get('hash0', 'top_songs', 3))
+        sizes = [entry.stat().st_size for entry in os.scandir(self.cache_dir)]
+        self.assertLessEqual(sum(sizes), 2000)
+        self.assertEqual(sum(sizes), cache._total_bytes)
+        self.assertIsNotNone(cache.get('hash0', 'top_songs', 3))
+        self.assertIsNotNone(cache.get('hash99', 'top_songs', 3))
+        self.assertIsNone(cache.get('hash50', 'top_songs', 3))
+
+    def test_open_query_cache_is_shared(self):
+        self.assertIs(open_query_cache(self.cache_dir, 1000), open_query_cache(self.cache_dir, 1000))
@@ -0,0 +1,201 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+from client_shards import SHARD_DIR, ShardError, client_shard_path, validate_client_shard, write_client_shard
+
+# Resumable state of one federated round.
+#
+# The checkpoint is an append-only JSON lines log next to the results CSV.
+# The first line identifies the round (dataset and results files, number of
+# clients, query); every later line records one step as soon as it is done:
+#
+#   {"event": "rows", "total_rows": n, "columns": {...}}      catalogue rows and column kinds, so a resume
+#                                                             skips the schema scan
+#   {"event": "distributed", "client_id": c, "content_hash": h, "num_rows": n}
+#   {"event": "response", "client_id": c, "top_songs": [[popularity, song], ...]}
+#   {"event": "failure", "client_id": c, "error": "..."}     missing or corrupt shard
+#   {"event": "aggregated", "client_ids": [...], "top_songs": [[song, value], ...]}
+#
+# A restarted round replays the log: shards that still match their recorded
+# hash are not rewritten, answered clients are not queried again and failed
+# clients are retried. A log written for a different round is started over,
+# and a last line cut short by a crash is dropped.
+
+CHECKPOINT_SUFFIX = '_checkpoint.jsonl'
+
+
+def file_signature(filename):
+    # Changes whenever the file is rewritten
+    stat = os.stat(filename)
+    return [os.path.abspath(filename), stat.st_size, stat.st_mtime_ns]
+
+
+class RoundCheckpoint:
+    def __init__(self, path, round_key):
+        self.path = path
+        self.round_key = json.loads(json.dumps(round_key))  # Compared with the key read back from JSON
+        self.total_rows = None
+        self.columns = None     # {column: kind} of the catalogue
+        self.distributed = {}   # {client_id: (content_hash, num_rows)}
+        self.responses = {}     # {client_id: [(popularity, song)]}
+        self.failures = {}      # {client_id: error}
+        self.aggregated = None  # ([client_id], [(song, value)])
+        self.resumed = self._load()
+        if not self.resumed:
+            with open(path, 'w') as f:
+                f.write(json.dumps({'event': 'round', 'key': self.round_key}) + '\n')
+        self._file = open(path, 'a')
+
+    def _load(self):
+        # Replays an existing log of this round; False when there is none to resume
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return False
+        events = []
+        valid_bytes = 0
+        for line in data.split(b'\n')[:-1]:  # Text after the last newline was never completed
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                break
+            valid_bytes += len(line) + 1
+        if not events or events[0] != {'event': 'round', 'key': self.round_key}:
+            return False
+        for event in events[1:]:
+            self._apply(event)
+        if valid_bytes < len(data):
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid_bytes)
+        return True
+
+    def _apply(self, event):
+        kind = event['event']
+        if kind == 'rows':
+            self.total_rows = event['total_rows']
+            self.columns = event['columns']
+        elif kind == 'distributed':
+            client_id = event['client_id']
+            previous = self.distributed.get(client_id)
+            if previous is not None and previous[0] != event['content_hash']:
+                # The shard changed, so its response and the aggregate are stale
+                self.responses.pop(client_id, None)
+                self.aggregated = None
+            self.distributed[client_id] = (event['content_hash'], event['num_rows'])
+        elif kind == 'response':
+            self.responses[event['client_id']] = [tuple(entry) for entry in event['top_songs']]
+            self.failures.pop(event['client_id'], None)
+        elif kind == 'failure':
+            self.failures[event['client_id']] = event['error']
+        elif kind == 'aggregated':
+            self.aggregated = (event['client_ids'], [tuple(entry) for entry in event['top_songs']])
+
+    def _record(self, event):
+        self._apply(event)
+        self._file.write(json.dumps(event) + '\n')
+        self._file.flush()
+
+    def record_total_rows(self, total_rows, columns):
+        self._record({'event': 'rows', 'total_rows': int(total_rows), 'columns': columns})
+
+    def record_distributed(self, client_id, content_hash, num_rows):
+        self._record({'event': 'distributed', 'client_id': int(client_id), 'content_hash': content_hash,
+                      'num_rows': int(num_rows)})
+
+    def record_response(self, client_id, top_songs):
+        self._record({'event': 'response', 'client_id': int(client_id),
+                      'top_songs': [[int(popularity), song] for popularity, song in top_songs]})
+
+    def record_failure(self, client_id, error):
+        self._record({'event': 'failure', 'client_id': int(client_id), 'error': str(error)})
+
+    def record_aggregated(self, client_ids, top_songs):
+        self._record({'event': 'aggregated', 'client_ids': [int(client_id) for client_id in client_ids],
+                      'top_songs': [[song, float(value)] for song, value in top_songs]})
+
+    def distributed_clients(self, shard_dir=SHARD_DIR):
+        # {client_id: num_rows} of the recorded shards that are still on disk unchanged
+        done = {}
+        for client_id, (content_hash, num_rows) in self.distributed.items():
+            try:
+                if validate_client_shard(client_id, shard_dir) == content_hash:
+                    done[client_id] = num_rows
+            except ShardError:
+                pass
+        return done
+
+    def aggregated_result(self, client_ids):
+        # The recorded final top songs if they were aggregated from exactly these clients
+        if self.aggregated is None or self.aggregated[0] != [int(client_id) for client_id in client_ids]:
+            return None
+        return self.aggregated[1]
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class RoundCheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, f'round{CHECKPOINT_SUFFIX}')
+        self.key = {'num_clients': 2, 'min_limit': 0.25}
+
+    def test_resume_after_truncated_line(self):
+        with RoundCheckpoint(self.path, self.key) as checkpoint:
+            self.assertFalse(checkpoint.resumed)
+            checkpoint.record_total_rows(10, {'track_name': 'string'})
+            checkpoint.record_response(1, [(90, 'a'), (80, 'b')])
+            checkpoint.record_failure(2, 'missing shard')
+        with open(self.path, 'a') as f:
+            f.write('{"event": "response", "client_id": 2, "top_so')  # Crash in the middle of a line
+        size = os.path.getsize(self.path)
+
+        with RoundCheckpoint(self.path, self.key) as checkpoint:
+            self.assertTrue(checkpoint.resumed)
+            self.assertEqual(checkpoint.total_rows, 10)
+            self.assertEqual(checkpoint.columns, {'track_name': 'string'})
+            self.assertEqual(checkpoint.responses, {1: [(90, 'a'), (80, 'b')]})
+            self.assertEqual(checkpoint.failures, {2: 'missing shard'})
+            self.assertLess(os.path.getsize(self.path), size)
+            checkpoint.record_response(2, [(70, 'c')])
+        with RoundCheckpoint(self.path, self.key) as checkpoint:
+            self.assertEqual(checkpoint.responses[2], [(70, 'c')])
+            self.assertEqual(checkpoint.failures, {})
+
+    def test_other_round_starts_over(self):
+        with RoundCheckpoint(self.path, self.key) as checkpoint:
+            checkpoint.record_response(1, [(90, 'a')])
+        with RoundCheckpoint(self.path, {**self.key, 'min_limit': 0.5}) as checkpoint:
+            self.assertFalse(checkpoint.resumed)
+            self.assertEqual(checkpoint.responses, {})
+
+    def test_changed_shard_invalidates_its_response(self):
+        shard_dir = os.path.join(self.directory, 'shards')
+        songs = pd.DataFrame({'track_name': ['a', 'b'], 'track_popularity': [90, 80]})
+        with RoundCheckpoint(self.path, self.key) as checkpoint:
+            write_client_shard(songs, client_shard_path(1, shard_dir))
+            checkpoint.record_distributed(1, validate_client_shard(1, shard_dir), 2)
+            checkpoint.record_response(1, [(90, 'a')])
+            checkpoint.record_aggregated([1], [('a', 90.0)])
+        with RoundCheckpoint(self.path, self.key) as checkpoint:
+            self.assertEqual(checkpoint.distributed_clients(shard_dir), {1: 2})
+            self.assertEqual(checkpoint.aggregated_result([1]), [('a', 90.0)])
+            self.assertIsNone(checkpoint.aggregated_result([1, 2]))
+            write_client_shard(songs.assign(track_popularity=[10, 20]), client_shard_path(1, shard_dir))
+            checkpoint.record_distributed(1, validate_client_shard(1, shard_dir), 2)
+            self.assertEqual(checkpoint.responses, {})
+            self.assertIsNone(checkpoint.aggregated_result([1]))
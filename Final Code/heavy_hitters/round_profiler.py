@@ -0,0 +1,101 @@
+import csv
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Per-stage timing and memory instrumentation for a federated round.
+#
+# RoundProfiler.stage() records wall time, CPU time, bytes read and written
+# (from /proc/self/io where available, plus any counts the caller adds) and
+# peak memory: the tracemalloc peak inside the stage and the process max RSS
+# after it. A disabled profiler hands out a shared no-op context, so the
+# instrumentation costs one method call per stage when it is switched off.
+
+PROFILE_COLUMNS = ['stage', 'client_id', 'wall_s', 'cpu_s', 'bytes_read', 'bytes_written',
+                   'peak_traced_bytes', 'max_rss_bytes']
+
+
+def _io_counters():
+    # (bytes read, bytes written) through read/write syscalls; None off Linux
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _max_rss_bytes():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@contextmanager
+def _null_stage():
+    yield {}
+
+
+class RoundProfiler:
+    def __init__(self, enabled=False, trace_memory=True):
+        self.enabled = enabled
+        self.trace_memory = trace_memory
+        self.records = []
+
+    def stage(self, name, client_id=None):
+        if not self.enabled:
+            return _null_stage()
+        return self._stage(name, client_id)
+
+    @contextmanager
+    def _stage(self, name, client_id):
+        # The yielded dict can be updated by the caller, e.g. with bytes_read of a memory-mapped shard
+        record = {'stage': name, 'client_id': client_id}
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        elif self.trace_memory:
+            tracemalloc.reset_peak()
+        io_start = _io_counters()
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['wall_s'] = time.perf_counter() - wall_start
+            record['cpu_s'] = time.process_time() - cpu_start
+            io_end = _io_counters()
+            if io_start is not None and io_end is not None:
+                record['bytes_read'] = record.get('bytes_read', 0) + io_end[0] - io_start[0]
+                record['bytes_written'] = record.get('bytes_written', 0) + io_end[1] - io_start[1]
+            if self.trace_memory:
+                record['peak_traced_bytes'] = tracemalloc.get_traced_memory()[1]
+                if started_tracing:
+                    tracemalloc.stop()
+            record['max_rss_bytes'] = _max_rss_bytes()
+            self.records.append(record)
+
+    def add_records(self, records):
+        # Records measured elsewhere, e.g. in pool worker processes
+        if self.enabled:
+            self.records.extend(records)
+
+    def write_report(self, basename, directory='.'):
+        # Writes <basename>_profile.json and <basename>_profile.csv; returns their paths
+        json_path = os.path.join(directory, f'{basename}_profile.json')
+        csv_path = os.path.join(directory, f'{basename}_profile.csv')
+        with open(json_path, 'w') as f:
+            json.dump({'stages': self.records}, f, indent=2)
+        with open(csv_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=PROFILE_COLUMNS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(self.records)
+        return json_path, csv_path
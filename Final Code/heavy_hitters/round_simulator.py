@@ -0,0 +1,176 @@
+import asyncio
+import bisect
+import math
+import random
+import unittest
+
+import pandas as pd
+
+# Asyncio simulation of one federated round over the links measured by ns-3.
+#
+# Every client runs its query concurrently; its response then takes the
+# client's measured mean delay to reach the server and is lost with the
+# client's measured packet loss ratio. The server stops waiting at the round
+# deadline or once the straggler cutoff fraction of clients has answered, and
+# aggregates whatever arrived. The query time is measured, the network delay
+# is added on a virtual clock, so nothing sleeps and the outcome does not
+# depend on how fast the simulation runs.
+
+
+def load_network_results(filename):
+    # The ns-3 CSVs are not consistent ('Delay (s)' vs 'Delay_(s)'), so names are normalized
+    results_df = pd.read_csv(filename)
+    results_df.columns = results_df.columns.str.strip().str.replace(' ', '_')
+    return results_df
+
+
+class ClientLink:
+    def __init__(self, client_id, tx_packets, rx_packets, delay, loss_ratio):
+        self.client_id = client_id
+        self.tx_packets = tx_packets
+        self.rx_packets = rx_packets
+        self.delay = delay                # mean one-way delay in seconds
+        self.loss_ratio = loss_ratio      # packet loss in [0, 1]
+
+    def drop_probability(self, packets=1):
+        # A response is lost if any of its packets is lost
+        return 1 - (1 - self.loss_ratio) ** packets
+
+
+def client_links(results_df):
+    links = []
+    for row in results_df.drop_duplicates('Client').to_dict('records'):
+        links.append(ClientLink(
+            client_id=int(row['Client']),
+            tx_packets=int(row['Tx_Packets']),
+            rx_packets=int(row['Rx_Packets']),
+            delay=float(row['Delay_(s)']),  # inf when ns-3 received nothing
+            loss_ratio=min(max(row['Packet_Loss_Ratio_(%)'] / 100, 0.0), 1.0),
+        ))
+    return links
+
+
+class RoundResult:
+    def __init__(self, responses, dropped, late, completion_time, num_clients):
+        self.responses = responses              # {client_id: result} that made the deadline
+        self.dropped = dropped                  # client ids whose response was lost
+        self.late = late                        # client ids still outstanding when the round closed
+        self.completion_time = completion_time  # seconds from round start to aggregation
+        self.num_clients = num_clients
+
+    def summary(self):
+        return {
+            'num_clients': self.num_clients,
+            'clients_on_time': len(self.responses),
+            'clients_dropped': len(self.dropped),
+            'clients_late': len(self.late),
+            'round_completion_time_s': self.completion_time,
+        }
+
+
+async def _timed_work(work, client_id, executor, start):
+    # Returns (result, seconds from round start until the work finished)
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(executor, work, client_id)
+    return result, loop.time() - start
+
+
+async def run_round(links, work, deadline=None, straggler_cutoff=1.0, seed=0, executor=None, response_packets=1):
+    # work(client_id) runs in the executor (default thread pool) and takes real time. The network is
+    # simulated on a virtual clock: a response arrives link.delay seconds after its work finished, and
+    # the deadline, straggler cutoff and completion_time are applied to those arrival times.
+    if not 0 < straggler_cutoff <= 1:
+        raise ValueError(f"straggler_cutoff must be in (0, 1], got {straggler_cutoff}")
+    loop = asyncio.get_running_loop()
+    rng = random.Random(seed)
+    # Losses are drawn up front so a seed reproduces the same round
+    drops = {link.client_id: rng.random() < link.drop_probability(response_packets) or not math.isfinite(link.delay)
+             for link in links}
+    delays = {link.client_id: link.delay for link in links}
+    needed = math.ceil(straggler_cutoff * len(links))  # At least one client when there are any
+
+    start = loop.time()
+    tasks = {asyncio.create_task(_timed_work(work, link.client_id, executor, start)): link.client_id
+             for link in links}
+    finished = {}   # {client_id: (result, work finish time)}
+    arrivals = []   # Sorted arrival times of the responses that are not lost
+    pending = set(tasks)
+    while pending:
+        # Clients still working finish after now, so their responses arrive after now too
+        now = loop.time() - start
+        if deadline is not None and now >= deadline:
+            break
+        if needed <= len(arrivals) and arrivals[needed - 1] <= now:
+            break
+        timeout = None if deadline is None else deadline - now
+        done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            client_id = tasks[task]
+            finished[client_id] = task.result()
+            if not drops[client_id]:
+                bisect.insort(arrivals, finished[client_id][1] + delays[client_id])
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+    # Responses in arrival order until the cutoff is reached or the deadline passes
+    delivered = sorted((finish + delays[client_id], client_id) for client_id, (_, finish) in finished.items()
+                       if not drops[client_id])
+    responses = {}
+    completion_time = 0.0
+    for arrival, client_id in delivered:
+        if len(responses) >= needed or (deadline is not None and arrival > deadline):
+            break
+        responses[client_id] = finished[client_id][0]
+        completion_time = arrival
+    if len(responses) < needed:
+        # The server waited for clients that never answered: until the deadline, or until the
+        # last lost response was known to be lost
+        last_event = max([completion_time] + [finish for _, finish in finished.values()])
+        unresolved = bool(pending) or len(delivered) > len(responses)
+        completion_time = deadline if deadline is not None and unresolved else last_event
+
+    dropped = [link.client_id for link in links if drops[link.client_id]]
+    late = [link.client_id for link in links if link.client_id not in responses and not drops[link.client_id]]
+    return RoundResult(responses, sorted(dropped), sorted(late), completion_time, len(links))
+
+
+def simulate_round(links, work, **kwargs):
+    return asyncio.run(run_round(links, work, **kwargs))
+
+
+class RunRoundTest(unittest.TestCase):
+
+    def links(self, delays, loss_ratio=0.0):
+        return [ClientLink(client_id, 10, 10, delay, loss_ratio) for client_id, delay in enumerate(delays, start=1)]
+
+    def test_straggler_cutoff_keeps_the_first_arrivals(self):
+        links = self.links([0.4, 0.1, 0.3, 0.2])
+        result = simulate_round(links, lambda client_id: client_id, straggler_cutoff=0.5)
+        self.assertEqual(sorted(result.responses), [2, 4])
+        self.assertEqual(result.late, [1, 3])
+        self.assertAlmostEqual(result.completion_time, 0.2, delta=0.05)
+        self.assertEqual(sorted(simulate_round(links, lambda client_id: client_id, straggler_cutoff=0.01).responses),
+                         [2])
+
+    def test_straggler_cutoff_must_be_positive(self):
+        for cutoff in (0, -0.5, 1.5):
+            with self.assertRaises(ValueError):
+                simulate_round(self.links([0.1]), lambda client_id: client_id, straggler_cutoff=cutoff)
+
+    def test_deadline_and_losses(self):
+        links = self.links([0.1, 0.5, math.inf]) + [ClientLink(4, 10, 0, 0.1, 1.0)]
+        result = simulate_round(links, lambda client_id: client_id, deadline=0.3)
+        self.assertEqual(result.responses, {1: 1})
+        self.assertEqual(result.dropped, [3, 4])
+        self.assertEqual(result.late, [2])
+        self.assertEqual(result.completion_time, 0.3)
+
+    def test_seed_reproduces_losses(self):
+        links = self.links([0.01] * 50, loss_ratio=0.5)
+        first = simulate_round(links, lambda client_id: client_id, seed=3)
+        second = simulate_round(links, lambda client_id: client_id, seed=3)
+        self.assertEqual(first.dropped, second.dropped)
+        self.assertTrue(0 < len(first.dropped) < 50)
+        self.assertEqual(sorted(first.responses), [link.client_id for link in links
+                                                   if link.client_id not in first.dropped])
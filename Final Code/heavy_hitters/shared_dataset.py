@@ -0,0 +1,159 @@
+import os
+import shutil
+import tempfile
+import unittest
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from client_shards import STRING_KIND, ClientShard, column_layout, encode_frame
+from song_stream import DEFAULT_CHUNKSIZE, read_song_chunks, scan_song_schema
+
+# Zero-copy shared-memory catalogue for in-process simulations.
+#
+# The catalogue is encoded once, in the columnar shard layout, into a single
+# multiprocessing.shared_memory block. A client is only a [start, end) row
+# range: client_shard() returns a ClientShard whose columns are slices of the
+# block, so creating a client copies nothing and a worker process attaches to
+# the block by name from a small picklable spec instead of receiving the rows.
+#
+# String columns keep their offsets absolute into the whole data buffer, so a
+# view slices num_rows + 1 offsets and shares the data buffer unchanged.
+#
+# from_csv sizes the block with one text scan of the CSV and then encodes it
+# chunk by chunk straight into the block, so setup holds the block and one
+# chunk instead of the whole frame, its encoded arrays and the block.
+
+_ALIGNMENT = 8
+
+
+class SharedDataset:
+    def __init__(self, shm, num_rows, columns, layout, owner):
+        self.shm = shm
+        self.num_rows = num_rows
+        self.columns = columns
+        self.layout = layout    # {(column, suffix): (byte offset, dtype str, count)}
+        self.owner = owner      # Only the creating process unlinks the block
+        self._arrays = {
+            key: np.ndarray((count,), dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)
+            for key, (offset, dtype, count) in layout.items()
+        }
+
+    @classmethod
+    def _create(cls, num_rows, columns, shapes):
+        # Allocates the block for {(column, suffix): (dtype str, count)}
+        layout = {}
+        size = 0
+        for key, (dtype, count) in shapes.items():
+            size = -(-size // _ALIGNMENT) * _ALIGNMENT
+            layout[key] = (size, dtype, count)
+            size += np.dtype(dtype).itemsize * count
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        return cls(shm, num_rows, columns, layout, owner=True)
+
+    @classmethod
+    def from_frame(cls, df):
+        columns, arrays = encode_frame(df)
+        dataset = cls._create(len(df), columns, {key: (array.dtype.str, len(array)) for key, array in arrays.items()})
+        for key, array in arrays.items():
+            dataset._arrays[key][:] = array
+        return dataset
+
+    @classmethod
+    def from_csv(cls, filename, chunksize=DEFAULT_CHUNKSIZE):
+        string_bytes = {}
+        num_rows, columns = scan_song_schema(filename, chunksize, string_bytes)
+        dataset = cls._create(num_rows, columns, column_layout(columns, num_rows, string_bytes))
+        try:
+            start = 0
+            data_sizes = {name: 0 for name, kind in columns.items() if kind == STRING_KIND}
+            for name in data_sizes:
+                dataset._arrays[(name, 'offsets')][0] = 0
+            for chunk in read_song_chunks(filename, chunksize, dtype=str):
+                _, arrays = encode_frame(chunk, columns)
+                end = start + len(chunk)
+                for (name, suffix), array in arrays.items():
+                    target = dataset._arrays[(name, suffix)]
+                    if suffix == 'offsets':
+                        # Chunk offsets start at 0; the block's are absolute
+                        target[start + 1:end + 1] = array[1:] + data_sizes[name]
+                    elif suffix == 'data':
+                        target[data_sizes[name]:data_sizes[name] + len(array)] = array
+                    else:
+                        target[start:end] = array
+                for name in data_sizes:
+                    data_sizes[name] += len(arrays[(name, 'data')])
+                start = end
+        except BaseException:
+            dataset.close()
+            raise
+        return dataset
+
+    def spec(self):
+        # Everything a worker needs to attach; a few hundred bytes whatever the catalogue size
+        return self.shm.name, self.num_rows, self.columns, self.layout
+
+    @classmethod
+    def attach(cls, spec):
+        name, num_rows, columns, layout = spec
+        # Pool workers share the creator's resource tracker, so attaching does not add an owner
+        shm = shared_memory.SharedMemory(name=name)
+        return cls(shm, num_rows, columns, layout, owner=False)
+
+    def client_shard(self, start, end):
+        arrays = {}
+        for (name, suffix), array in self._arrays.items():
+            if self.columns[name] == STRING_KIND and suffix == 'data':
+                arrays[(name, suffix)] = array
+            elif suffix == 'offsets':
+                arrays[(name, suffix)] = array[start:end + 1]
+            else:
+                arrays[(name, suffix)] = array[start:end]
+        return ClientShard(end - start, self.columns, arrays=arrays)
+
+    def close(self):
+        # Views returned by client_shard must not be used after close
+        self._arrays = {}
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class SharedDatasetTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.filename = os.path.join(directory, 'songs.csv')
+        pd.DataFrame({
+            'track_name': ['a', 'bb', None, 'dddd', 'é', 'f', 'g'],
+            'track_popularity': [10, 90, 50, None, 90, 70, 5],
+            'playlist_genre': ['pop', 'rock', 'pop', 'pop', 'rock', 'pop', 'rap'],
+            'danceability': [0.5, None, 0.1, 0.2, 0.3, 0.4, 0.9],
+        }).to_csv(self.filename, index=False)
+
+    def test_from_csv_matches_from_frame(self):
+        with SharedDataset.from_frame(pd.read_csv(self.filename)) as expected, \
+                SharedDataset.from_csv(self.filename, chunksize=3) as dataset:
+            self.assertEqual(dataset.columns, expected.columns)
+            self.assertEqual(dataset.num_rows, 7)
+            for key, array in expected._arrays.items():
+                np.testing.assert_array_equal(dataset._arrays[key], array)
+
+    def test_client_views(self):
+        with SharedDataset.from_csv(self.filename, chunksize=2) as dataset:
+            view = dataset.client_shard(3, 6)
+            self.assertEqual(len(view), 3)
+            self.assertEqual(view.strings('track_name'), ['dddd', 'é', 'f'])
+            values, valid = view.numeric('track_popularity')
+            self.assertEqual(values[valid.astype(bool)].tolist(), [90, 70])
+            attached = SharedDataset.attach(dataset.spec())
+            self.assertEqual(attached.client_shard(0, 2).strings('track_name'), ['a', 'bb'])
+            attached.close()
@@ -0,0 +1,77 @@
+import heapq
+
+import pandas as pd
+
+from client_shards import text_column_kind, widest_kind
+
+# Chunked reading of the songs catalogue. Peak memory depends on the chunk
+# size (and k for top-k queries), not on the size of the CSV file.
+
+DATASET_FILENAME = 'spotify_songs.csv'
+DEFAULT_CHUNKSIZE = 50_000
+
+
+def read_song_chunks(filename=DATASET_FILENAME, chunksize=DEFAULT_CHUNKSIZE, usecols=None, dtype=None):
+    # Yields DataFrame chunks with whitespace stripped from column names
+    reader = pd.read_csv(filename, chunksize=chunksize, low_memory=False, dtype=dtype,
+                         usecols=(lambda name: name.strip() in usecols) if usecols is not None else None)
+    with reader:
+        for chunk in reader:
+            chunk.columns = chunk.columns.str.strip()
+            yield chunk
+
+
+def scan_song_schema(filename=DATASET_FILENAME, chunksize=DEFAULT_CHUNKSIZE, string_bytes=None):
+    # One pass over the CSV read as text: (number of rows, {column: kind}). Chunked readers infer
+    # dtypes per chunk, so a column can look numeric in one chunk and not in the next; shards are
+    # written with these whole-file kinds from chunks read with dtype=str.
+    # A string_bytes dict is filled with the UTF-8 size of every column's values.
+    total_rows = 0
+    columns = {}
+    for chunk in read_song_chunks(filename, chunksize, dtype=str):
+        total_rows += len(chunk)
+        for name in chunk.columns:
+            kind = text_column_kind(name, chunk[name])
+            columns[name] = widest_kind(columns[name], kind) if name in columns else kind
+            if string_bytes is not None:
+                size = chunk[name].dropna().str.encode('utf-8').str.len().sum()
+                string_bytes[name] = string_bytes.get(name, 0) + int(size)
+    return total_rows, columns
+
+
+class RunningTopK:
+    # Keeps the k most popular songs seen so far in a min-heap. Ties are broken
+    # by file order (the earlier row wins), the same as nlargest(keep='first').
+
+    def __init__(self, k=3):
+        self.k = k
+        self._heap = []
+        self._rows_seen = 0
+
+    def update(self, chunk):
+        popularity = pd.to_numeric(chunk['track_popularity'], errors='coerce')
+        # Only the chunk's own top k can enter the running top k
+        for position, value in popularity.reset_index(drop=True).dropna().nlargest(self.k).items():
+            row = chunk.iloc[position]
+            song = f"{row['track_name']} - {row['track_artist']} ({row['playlist_genre']})"
+            entry = (int(value), -(self._rows_seen + position), song)
+            if len(self._heap) < self.k:
+                heapq.heappush(self._heap, entry)
+            elif entry > self._heap[0]:
+                heapq.heapreplace(self._heap, entry)
+        self._rows_seen += len(chunk)
+
+    def result(self):
+        # Returns [(popularity, song)] from most to least popular
+        return [(popularity, song) for popularity, _, song in sorted(self._heap, reverse=True)]
+
+
+def find_top_songs_streaming(filename=DATASET_FILENAME, k=3, chunksize=DEFAULT_CHUNKSIZE, genre=None):
+    # With genre, only songs of that playlist_genre are considered
+    top_k = RunningTopK(k)
+    usecols = ['track_popularity', 'track_name', 'track_artist', 'playlist_genre']
+    for chunk in read_song_chunks(filename, chunksize, usecols=usecols):
+        if genre is not None:
+            chunk = chunk[chunk['playlist_genre'] == genre]
+        top_k.update(chunk)
+    return top_k.result()
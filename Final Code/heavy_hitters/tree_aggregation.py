@@ -0,0 +1,68 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from item_aggregation import ItemAggregator
+
+# Hierarchical (tree) aggregation of client responses.
+#
+# Responses are merged in groups of fan_out by intermediate aggregators, level
+# by level, and the root only merges the last level's pre-merged summaries.
+# A level holds at most n / fan_out summaries instead of the n responses, and
+# with an executor (e.g. a ProcessPoolExecutor) the groups of each level are
+# merged in separate processes. Groups are contiguous and executor.map keeps
+# their order, so the first appearance of every key, which breaks ties in
+# ItemAggregator.top_k, is the same as in a flat aggregation.
+
+
+def _groups(partials, fan_out):
+    iterator = iter(partials)
+    while True:
+        group = list(itertools.islice(iterator, fan_out))
+        if not group:
+            return
+        yield group
+
+
+def tree_reduce(partials, merge_group, fan_out, executor=None):
+    # Returns the merge of all partials, or None if there are none
+    if fan_out < 2:
+        raise ValueError("fan_out must be at least 2")
+    level = partials
+    while True:
+        groups = _groups(level, fan_out)
+        merged = list(executor.map(merge_group, groups) if executor is not None else map(merge_group, groups))
+        if len(merged) <= 1:
+            return merged[0] if merged else None
+        level = merged
+
+
+def song_partial(top_songs):
+    # A client's [(popularity, song)] as a (songs, popularity sums, counts) summary
+    popularities, songs = zip(*top_songs)
+    return merge_song_partials([(np.array(songs, dtype=object), np.array(popularities, dtype=np.float64),
+                                 np.ones(len(songs), dtype=np.int64))])
+
+
+def merge_song_partials(partials):
+    # One (songs, sums, counts) summary with distinct songs in order of first appearance
+    songs = np.concatenate([songs for songs, _, _ in partials])
+    codes, unique_songs = pd.factorize(songs)
+    sums = np.bincount(codes, weights=np.concatenate([sums for _, sums, _ in partials]), minlength=len(unique_songs))
+    counts = np.zeros(len(unique_songs), dtype=np.int64)
+    np.add.at(counts, codes, np.concatenate([counts for _, _, counts in partials]))
+    return np.asarray(unique_songs, dtype=object), sums, counts
+
+
+def aggregate_top_songs_tree(client_results, k=3, fan_out=16, executor=None):
+    # Same result as aggregate_top_songs over the concatenated responses; client_results
+    # yields one [(popularity, song)] list per client
+    partials = (song_partial(top_songs) for top_songs in client_results if top_songs)
+    merged = tree_reduce(partials, merge_song_partials, fan_out, executor)
+    if merged is None:
+        return []
+    songs, sums, counts = merged
+    aggregator = ItemAggregator()
+    aggregator.add(aggregator.dictionary.encode(songs), sums, counts)
+    return aggregator.top_k(k, statistic='mean')
@@ -0,0 +1,254 @@
+import unittest
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from item_aggregation import ItemDictionary
+
+# Compact binary encoding of client responses.
+#
+# A response is a list of (item label, integer value) entries, e.g. a client's
+# top songs with their popularity or a heavy hitters {item: count} dict. The
+# payload is one flags byte followed by the body, zlib-compressed when
+# FLAG_COMPRESSED is set:
+#
+#   varint   number of entries n
+#   varint   number of labels in the label table
+#   varint   first new dictionary ID           (FLAG_DICTIONARY only)
+#   varints  label lengths, then the UTF-8 labels back to back
+#   varints  n item IDs
+#   varints  n values, zigzag-coded deltas from the previous value
+#
+# Without a dictionary, the IDs index the message's own label table. With a
+# shared ItemDictionary, the IDs are dictionary IDs and the table only holds
+# labels the dictionary did not know yet, so a repeated item costs a few
+# bytes. Entry order is kept, and top-k lists sorted by value give small deltas.
+#
+# A dictionary is state of one client-server link (WireLink): both ends only
+# learn the labels of payloads that were delivered, so a client never leaves
+# out a label because another client or a lost payload carried it.
+
+FLAG_COMPRESSED = 0x01
+FLAG_DICTIONARY = 0x02
+
+# Packet size of the ns-3 OnOff application in ns3_rede_wifi_code.cc
+PACKET_SIZE = 1024
+
+_VARINT_SHIFTS = np.arange(10, dtype=np.uint64) * np.uint64(7)
+
+
+def _encode_varints(values):
+    # LEB128: 7 bits per byte, high bit set on every byte but the last
+    values = np.asarray(values, dtype=np.uint64).reshape(-1)
+    if values.size == 0:
+        return b''
+    groups = values[:, None] >> _VARINT_SHIFTS
+    nbytes = np.maximum(1, np.count_nonzero(groups, axis=1))
+    positions = np.arange(len(_VARINT_SHIFTS))
+    more = positions < (nbytes - 1)[:, None]
+    encoded = ((groups & np.uint64(0x7F)) | (more * np.uint64(0x80))).astype(np.uint8)
+    return encoded[positions < nbytes[:, None]].tobytes()
+
+
+def _decode_varints(buffer, position, count):
+    # Returns (values as uint64, position after the last one)
+    if count == 0:
+        return np.zeros(0, dtype=np.uint64), position
+    data = np.frombuffer(buffer, dtype=np.uint8, offset=position)
+    ends = np.flatnonzero(data < 0x80)[:count]
+    if len(ends) < count:
+        raise ValueError("Truncated payload")
+    data = data[:ends[-1] + 1].astype(np.uint64)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    group = np.zeros(len(data), dtype=np.int64)
+    group[starts[1:]] = 1
+    group = np.cumsum(group)
+    shifts = (np.arange(len(data)) - starts[group]).astype(np.uint64) * np.uint64(7)
+    values = np.zeros(count, dtype=np.uint64)
+    np.add.at(values, group, (data & np.uint64(0x7F)) << shifts)
+    return values, position + len(data)
+
+
+def _zigzag(values):
+    values = values.astype(np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def _unzigzag(values):
+    return (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+
+
+def encode_response(items, values, dictionary=None, compress=False):
+    # items are string labels and values integers; dictionary is an item_aggregation.ItemDictionary
+    # shared with the decoder, and is extended with any new labels
+    items = [str(item) for item in items]
+    values = np.asarray(values)
+    if len(items) != values.size:
+        raise ValueError("items and values must have the same length")
+    if values.size and not np.issubdtype(values.dtype, np.integer):
+        raise ValueError("Only integer values can be encoded")
+
+    flags = 0
+    header = []
+    if dictionary is None:
+        codes, labels = pd.factorize(np.asarray(items, dtype=object))
+        ids, labels = codes, list(labels)
+    else:
+        flags |= FLAG_DICTIONARY
+        first_new_id = len(dictionary)
+        ids = dictionary.encode(items)
+        labels = dictionary.keys[first_new_id:]
+        header = [first_new_id]
+    encoded_labels = [label.encode('utf-8') for label in labels]
+
+    body = b''.join([
+        _encode_varints([len(items), len(encoded_labels)] + header),
+        _encode_varints([len(label) for label in encoded_labels]),
+        *encoded_labels,
+        _encode_varints(ids),
+        _encode_varints(_zigzag(np.diff(values.astype(np.int64), prepend=0))),
+    ])
+    if compress:
+        flags |= FLAG_COMPRESSED
+        body = zlib.compress(body)
+    return bytes([flags]) + body
+
+
+def decode_response(payload, dictionary=None):
+    # Returns (items, values); a payload encoded with a dictionary needs the same dictionary
+    flags = payload[0]
+    body = zlib.decompress(payload[1:]) if flags & FLAG_COMPRESSED else bytes(payload[1:])
+    with_dictionary = bool(flags & FLAG_DICTIONARY)
+    if with_dictionary and dictionary is None:
+        raise ValueError("Payload was encoded with a dictionary")
+
+    header, position = _decode_varints(body, 0, 3 if with_dictionary else 2)
+    num_entries, num_labels = int(header[0]), int(header[1])
+    lengths, position = _decode_varints(body, position, num_labels)
+    labels = []
+    for length in lengths.tolist():
+        labels.append(body[position:position + length].decode('utf-8'))
+        position += length
+    ids, position = _decode_varints(body, position, num_entries)
+    deltas, position = _decode_varints(body, position, num_entries)
+    values = np.cumsum(_unzigzag(deltas))
+
+    if not with_dictionary:
+        return [labels[item_id] for item_id in ids.tolist()], values
+    first_new_id = int(header[2])
+    new_ids = dictionary.encode(labels)
+    if not np.array_equal(new_ids, np.arange(first_new_id, first_new_id + len(labels))):
+        raise ValueError("Dictionary is out of sync with the encoder")
+    return dictionary.decode(ids.astype(np.int64)), values
+
+
+def encode_top_songs(top_songs, dictionary=None, compress=False):
+    # [(popularity, song)] as returned by find_top_songs
+    popularities = [popularity for popularity, _ in top_songs]
+    songs = [song for _, song in top_songs]
+    return encode_response(songs, np.array(popularities, dtype=np.int64), dictionary, compress)
+
+
+def decode_top_songs(payload, dictionary=None):
+    songs, popularities = decode_response(payload, dictionary)
+    return list(zip(popularities.tolist(), songs))
+
+
+def encode_counts(counts, dictionary=None, compress=False):
+    # {item: count} as returned by Client.find_heavy_hitters
+    return encode_response(list(counts), np.fromiter(counts.values(), dtype=np.int64, count=len(counts)),
+                           dictionary, compress)
+
+
+def decode_counts(payload, dictionary=None):
+    items, counts = decode_response(payload, dictionary)
+    return dict(zip(items, counts.tolist()))
+
+
+class WireLink:
+    # The client's and the server's dictionary of one link, kept in sync across rounds
+
+    def __init__(self):
+        self.client_dictionary = ItemDictionary()
+        self.server_dictionary = ItemDictionary()
+        self._acknowledged = 0  # Client dictionary size the server is known to have
+
+    def send_top_songs(self, top_songs, compress=False):
+        # Client side; the labels it adds stay provisional until the payload is delivered
+        self.client_dictionary.truncate(self._acknowledged)
+        return encode_top_songs(top_songs, self.client_dictionary, compress)
+
+    def deliver(self, payload):
+        # Server side of a payload that arrived
+        top_songs = decode_top_songs(payload, self.server_dictionary)
+        self._acknowledged = len(self.client_dictionary)
+        return top_songs
+
+    def lose(self):
+        # The payload never arrived, so its new labels must be sent again
+        self.client_dictionary.truncate(self._acknowledged)
+
+
+def packets_for_payload(num_bytes, packet_size=PACKET_SIZE):
+    return max(1, -(-num_bytes // packet_size))
+
+
+def payload_report(payloads, packet_size=PACKET_SIZE):
+    # Bytes and packets per response, from {client_id: payload}
+    return pd.DataFrame([{
+        'client_id': client_id,
+        'payload_bytes': len(payload),
+        'packets': packets_for_payload(len(payload), packet_size),
+    } for client_id, payload in payloads.items()], columns=['client_id', 'payload_bytes', 'packets'])
+
+
+class WireFormatTest(unittest.TestCase):
+
+    def test_varints_round_trip(self):
+        values = np.array([0, 1, 127, 128, 300, 2 ** 32, 2 ** 63, 2 ** 64 - 1], dtype=np.uint64)
+        encoded = _encode_varints(values)
+        self.assertEqual(encoded[:4], bytes([0, 1, 0x7F, 0x80]))
+        decoded, position = _decode_varints(b'x' + encoded, 1, len(values))
+        np.testing.assert_array_equal(decoded, values)
+        self.assertEqual(position, 1 + len(encoded))
+        with self.assertRaises(ValueError):
+            _decode_varints(encoded[:-1], 0, len(values))
+
+    def test_zigzag_round_trip(self):
+        values = np.array([0, -1, 1, -2, 2, 2 ** 62, -2 ** 63, 2 ** 63 - 1], dtype=np.int64)
+        coded = _zigzag(values)
+        np.testing.assert_array_equal(coded[:5], [0, 1, 2, 3, 4])
+        np.testing.assert_array_equal(_unzigzag(coded), values)
+
+    def test_response_round_trip(self):
+        top_songs = [(100, 'Song 1 - Artist (pop)'), (97, 'Canção - Artista (rock)'), (97, 'Song 1 - Artist (pop)')]
+        for compress in (False, True):
+            self.assertEqual(decode_top_songs(encode_top_songs(top_songs, compress=compress)), top_songs)
+            client, server = ItemDictionary(), ItemDictionary()
+            for _ in range(2):
+                payload = encode_top_songs(top_songs, client, compress)
+                self.assertEqual(decode_top_songs(payload, server), top_songs)
+        counts = {'item1': 5, 'item2': -3, 'item3': 0}
+        self.assertEqual(decode_counts(encode_counts(counts)), counts)
+
+    def test_known_labels_are_not_resent(self):
+        top_songs = [(90, 'Song A - Artist (pop)'), (80, 'Song B - Artist (rock)')]
+        link = WireLink()
+        first = link.send_top_songs(top_songs)
+        self.assertEqual(link.deliver(first), top_songs)
+        second = link.send_top_songs(top_songs)
+        self.assertLess(len(second), len(first))
+        self.assertEqual(link.deliver(second), top_songs)
+
+    def test_lost_payload_resends_its_labels(self):
+        link = WireLink()
+        link.deliver(link.send_top_songs([(90, 'Song A - Artist (pop)')]))
+        lost = link.send_top_songs([(80, 'Song B - Artist (rock)')])
+        link.lose()
+        resent = link.send_top_songs([(80, 'Song B - Artist (rock)')])
+        self.assertEqual(resent, lost)
+        self.assertEqual(link.deliver(resent), [(80, 'Song B - Artist (rock)')])
+
+    def test_packets(self):
+        self.assertEqual([packets_for_payload(size) for size in (0, 1, 1024, 1025)], [1, 1, 1, 2])
@@ -0,0 +1,233 @@
+import argparse
+import gc
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+# Reproducible benchmarks for the heavy hitters and federated song pipelines.
+#
+# Every case runs on synthetic data drawn from a seeded Zipf distribution and
+# sweeps clients, rows per client, distinct items and k. For each grid point
+# the case is timed `repeats` times, then run once more under tracemalloc for
+# peak memory. Results go to a JSON file so two runs can be diffed.
+#
+#   python benchmarks/benchmark_suite.py --grid quick --output bench_results.json
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [
+    os.path.join(REPO_ROOT, 'Code 1'),
+    os.path.join(REPO_ROOT, 'Code 2'),
+    os.path.join(REPO_ROOT, 'Final Code', 'heavy_hitters'),
+]
+
+from FA1 import Client, CountMin, FederatedServer, ItemDictionary, MisraGries, SpaceSaving  # noqa: E402
+from heavy_hitters_utils import compute_threshold_leakage, top_k  # noqa: E402
+from fa_ns3_popular_song_federated_code import aggregate_top_songs, distribute_data, query_clients  # noqa: E402
+
+GRIDS = {
+    'smoke': {
+        'clients': [2],
+        'rows_per_client': [200],
+        'distinct_items': [50],
+        'k': [3],
+    },
+    'quick': {
+        'clients': [4, 16],
+        'rows_per_client': [1_000, 10_000],
+        'distinct_items': [100, 10_000],
+        'k': [3, 100],
+    },
+    'full': {
+        'clients': [10, 100, 500],
+        'rows_per_client': [1_000, 10_000, 100_000],
+        'distinct_items': [1_000, 100_000, 1_000_000],
+        'k': [3, 100, 1_000],
+    },
+}
+
+FA1_BACKENDS = {
+    'dict': lambda k: {},
+    'encoded': lambda k: {'dictionary': ItemDictionary()},
+    'dict_tree': lambda k: {'fan_out': 16},
+    'misra_gries': lambda k: {'sketch_factory': lambda: MisraGries(k)},
+    'space_saving': lambda k: {'sketch_factory': lambda: SpaceSaving(k)},
+    'count_min': lambda k: {'sketch_factory': lambda: CountMin(capacity=k)},
+}
+
+
+def zipf_signal(rng, num_rows, distinct_items):
+    # Zipf-distributed integer IDs folded into [0, distinct_items)
+    return (rng.zipf(1.2, num_rows) - 1) % distinct_items
+
+
+def synthetic_songs(rng, num_rows, distinct_items):
+    song_ids = zipf_signal(rng, num_rows, distinct_items)
+    genres = np.array(['pop', 'rock', 'rap', 'latin', 'r&b', 'edm'])
+    return pd.DataFrame({
+        'track_name': [f'Song {song_id}' for song_id in song_ids],
+        'track_artist': [f'Artist {song_id % 997}' for song_id in song_ids],
+        'track_popularity': rng.integers(0, 101, num_rows),
+        'playlist_genre': genres[song_ids % len(genres)],
+    })
+
+
+def bench_fa1(rng, clients, rows_per_client, distinct_items, k, backend):
+    # Client.report_counts / find_heavy_hitters + FederatedServer.aggregate
+    clients_data = [[f'item{item}' for item in zipf_signal(rng, rows_per_client, distinct_items)]
+                    for _ in range(clients)]
+    fa1_clients = [Client(data) for data in clients_data]
+    threshold = max(1, rows_per_client // 100)
+
+    def run():
+        server = FederatedServer(**FA1_BACKENDS[backend](k))
+        server.send_task(fa1_clients, threshold)
+        return server.get_final_heavy_hitters(threshold)
+
+    return run, clients * rows_per_client
+
+
+def bench_top_k(rng, clients, rows_per_client, distinct_items, k, batched):
+    # One signal of clients * rows_per_client values; batched mode streams one client at a time
+    signal = zipf_signal(rng, clients * rows_per_client, distinct_items)
+
+    def run():
+        if batched:
+            return top_k(iter(np.array_split(signal, clients)), k)
+        return top_k(signal, k)
+
+    return run, signal.size
+
+
+def bench_threshold_leakage(rng, clients, rows_per_client, distinct_items, k):
+    # k thresholds spread over the signal's range
+    signal = zipf_signal(rng, clients * rows_per_client, distinct_items)
+    thresholds = np.linspace(0, distinct_items, k)
+
+    def run():
+        return compute_threshold_leakage(signal, thresholds)
+
+    return run, signal.size
+
+
+def bench_song_round(rng, clients, rows_per_client, distinct_items, k, shard_dir):
+    # distribute_data + find_top_songs on every client + aggregation
+    df = synthetic_songs(rng, clients * rows_per_client, distinct_items)
+
+    def run():
+        distribute_data(df, clients, shard_dir=shard_dir)
+        results_from_clients = []
+        for _, top_songs in query_clients(range(1, clients + 1), shard_dir=shard_dir, k=k):
+            results_from_clients.extend(top_songs)
+        return aggregate_top_songs(results_from_clients, k)
+
+    return run, len(df)
+
+
+def measure(run, rows, repeats):
+    run()  # Warm-up
+    latencies = []
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        latencies.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    run()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = np.array(latencies)
+    return {
+        'repeats': repeats,
+        'latency_p50_s': float(np.percentile(latencies, 50)),
+        'latency_p90_s': float(np.percentile(latencies, 90)),
+        'latency_p99_s': float(np.percentile(latencies, 99)),
+        'latency_mean_s': float(latencies.mean()),
+        'throughput_rows_per_s': float(rows / np.median(latencies)) if latencies.size else None,
+        'peak_memory_bytes': int(peak_memory),
+    }
+
+
+def benchmark_cases(shard_dir):
+    # Yields (benchmark name, extra params, factory(rng, clients, rows_per_client, distinct_items, k))
+    for backend in FA1_BACKENDS:
+        yield 'fa1_heavy_hitters', {'backend': backend}, \
+            lambda rng, *params, backend=backend: bench_fa1(rng, *params, backend=backend)
+    for batched in (False, True):
+        yield 'top_k', {'batched': batched}, \
+            lambda rng, *params, batched=batched: bench_top_k(rng, *params, batched=batched)
+    yield 'compute_threshold_leakage', {}, bench_threshold_leakage
+    yield 'song_round', {}, lambda rng, *params: bench_song_round(rng, *params, shard_dir=shard_dir)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(grid, repeats=5, seed=0, only=None):
+    shard_dir = tempfile.mkdtemp(prefix='bench_shards_')
+    results = []
+    try:
+        for name, extra_params, factory in benchmark_cases(shard_dir):
+            if only and name not in only:
+                continue
+            for clients, rows_per_client, distinct_items, k in itertools.product(
+                    grid['clients'], grid['rows_per_client'], grid['distinct_items'], grid['k']):
+                rng = np.random.default_rng(seed)
+                run, rows = factory(rng, clients, rows_per_client, distinct_items, k)
+                params = {'clients': clients, 'rows_per_client': rows_per_client,
+                          'distinct_items': distinct_items, 'k': k, **extra_params}
+                record = {'benchmark': name, 'params': params, **measure(run, rows, repeats)}
+                print(f"{name} {params}: p50 {record['latency_p50_s'] * 1000:.2f} ms, "
+                      f"peak {record['peak_memory_bytes'] / 1e6:.1f} MB", flush=True)
+                results.append(record)
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the heavy hitters and federated song pipelines")
+    parser.add_argument('--grid', choices=sorted(GRIDS), default='quick')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', nargs='+', default=None, help="Benchmark names to run (default: all)")
+    parser.add_argument('--output', default='bench_results.json')
+    args = parser.parse_args()
+
+    grid = GRIDS[args.grid]
+    results = run_benchmarks(grid, repeats=args.repeats, seed=args.seed, only=args.only)
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'grid': args.grid,
+        'seed': args.seed,
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()